@@ -1,5 +1,5 @@
 from django.contrib import admin
-from domain.models import Product, Order, OrderLine, Address, ShopifyConfig, ShopifyProduct, ShopifyOrder
+from domain.models import Product, Order, OrderLine, Address, ShopifyConfig, ShopifyProduct, ShopifyOrder, FulfillmentOutbox
 
 class OrderLineInline(admin.TabularInline):
     model = OrderLine
@@ -16,4 +16,9 @@ admin.site.register(Product)
 admin.site.register(Address)
 admin.site.register(ShopifyConfig)
 admin.site.register(ShopifyProduct)
-admin.site.register(ShopifyOrder)
\ No newline at end of file
+admin.site.register(ShopifyOrder)
+
+@admin.register(FulfillmentOutbox)
+class FulfillmentOutboxAdmin(admin.ModelAdmin):
+    list_display = ['id', 'order', 'status', 'attempts', 'next_attempt_at', 'updated_at']
+    list_filter = ['status']
\ No newline at end of file
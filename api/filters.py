@@ -9,6 +9,9 @@ class OrderFilter(filters.FilterSet):
     
     status = filters.ChoiceFilter(choices=Order.Status.choices)
 
+    created_after = filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='lt')
+
     class Meta:
         model = Order
         fields = ['status', 'reference']
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.filters import OrderFilter
+from business.exports import ExportService
+
+class Command(BaseCommand):
+    help = 'Stream orders or products as NDJSON or CSV to a file or stdout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=['orders', 'products'])
+        parser.add_argument('--export-format', choices=list(ExportService.FORMATS), default='ndjson')
+        parser.add_argument('--output', help='File to write, stdout by default')
+        parser.add_argument('--chunk-size', type=int, default=settings.EXPORT_CHUNK_SIZE)
+        parser.add_argument('--status', help='Only export orders in this status')
+        parser.add_argument('--status-in', help='Comma separated statuses')
+        parser.add_argument('--reference', help='Only export the order with this reference')
+        parser.add_argument('--created-after', help='ISO 8601 datetime, inclusive')
+        parser.add_argument('--created-before', help='ISO 8601 datetime, exclusive')
+
+    def handle(self, *args, **options):
+        if options['model'] == 'orders':
+            rows = ExportService.stream_orders(
+                self._filter_orders(options), options['export_format'], options['chunk_size']
+            )
+        else:
+            rows = ExportService.stream_products(
+                ExportService.products_queryset(), options['export_format'], options['chunk_size']
+            )
+
+        if not options['output']:
+            # self.stdout honours call_command(stdout=...), the chunks carry their own newlines
+            for chunk in rows:
+                self.stdout.write(chunk, ending='')
+            return
+
+        with open(options['output'], 'w', newline='') as out:
+            for chunk in rows:
+                out.write(chunk)
+
+    def _filter_orders(self, options):
+        # Same criteria as the API export
+        data = {
+            key: options[option]
+            for key, option in [
+                ('status', 'status'),
+                ('status__in', 'status_in'),
+                ('reference', 'reference'),
+                ('created_after', 'created_after'),
+                ('created_before', 'created_before'),
+            ]
+            if options[option]
+        }
+        filterset = OrderFilter(data, queryset=ExportService.orders_queryset())
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors.as_text())
+        return filterset.qs
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from business.shopify_products import ShopifyProductService
+from domain.models import ShopifyConfig
+
+class Command(BaseCommand):
+    help = 'Push the stock of every product to Shopify, ignoring the last pushed quantities'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', help='Only resync this shop_url')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        configs = ShopifyConfig.objects.filter(active=True)
+        if options['shop']:
+            configs = configs.filter(shop_url=options['shop'])
+        configs = list(configs)
+
+        if not configs:
+            self.stdout.write(self.style.WARNING("No active shops found."))
+            return
+
+        self.stdout.write(f"Resyncing inventory to {len(configs)} shop(s)...")
+        stats = ShopifyProductService.resync_all_inventory(configs=configs, batch_size=options['batch_size'])
+
+        style = self.style.ERROR if stats['failed'] else self.style.SUCCESS
+        self.stdout.write(style(f"Pushed: {stats['pushed']}, Failed: {stats['failed']}"))
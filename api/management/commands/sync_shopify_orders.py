@@ -1,13 +1,33 @@
-from django.core.management.base import BaseCommand
+from datetime import datetime, time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
 from business.shopify_orders import ShopifyOrderService
+from business.tasks import shop_sync_group
+from domain.models import ShopifyConfig
 
 class Command(BaseCommand):
     help = 'Sync orders for all active shopify configs'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--parallel', action='store_true', help='Run one Celery task per shop and wait for all of them')
+        parser.add_argument('--timeout', type=int, default=900, help='Seconds to wait for the parallel syncs')
+        parser.add_argument('--backfill', action='store_true', help='Import orders through a Shopify bulk operation')
+        parser.add_argument('--since', help='Backfill only orders updated since this date (YYYY-MM-DD)')
+        parser.add_argument('--jsonl-file', help='Backfill from a downloaded bulk operation JSONL file (requires --shop)')
+        parser.add_argument('--shop', help='Only sync this shop_url')
+
     def handle(self, *args, **options):
         self.stdout.write("Starting synchronization...")
         
-        results = ShopifyOrderService.sync_all_active_shops()
+        if options['backfill'] or options['jsonl_file']:
+            results = self._backfill(options)
+        elif options['parallel']:
+            results = self._sync_parallel(options['timeout'], options['shop'])
+        elif options['shop']:
+            results = {config.shop_url: ShopifyOrderService.sync_store_orders_locked(config)
+                       for config in self._configs(options['shop'])}
+        else:
+            results = ShopifyOrderService.sync_all_active_shops()
         
         if not results:
              self.stdout.write(self.style.WARNING("No active shops found or empty results."))
@@ -18,5 +38,40 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR(f"[{shop}] Error: {stats['error']}"))
             else:
                 self.stdout.write(self.style.SUCCESS(
-                    f"[{shop}] Created: {stats['created']}, Updated: {stats['updated']}"
-                ))
\ No newline at end of file
+                    f"[{shop}] Created: {stats['created']}, Updated: {stats['updated']}, "
+                    f"Unchanged: {stats.get('skipped', 0)}"
+                ))
+
+    def _configs(self, shop=None):
+        configs = ShopifyConfig.objects.filter(active=True)
+        if shop:
+            configs = configs.filter(shop_url=shop)
+        return list(configs)
+
+    def _sync_parallel(self, timeout, shop=None):
+        config_ids = [config.pk for config in self._configs(shop)]
+        if not config_ids:
+            return {}
+
+        results = shop_sync_group(config_ids).apply_async().get(timeout=timeout)
+        return {result["shop"]: result["stats"] for result in results if result["shop"]}
+
+    def _backfill(self, options):
+        jsonl_file = options['jsonl_file']
+        if jsonl_file and not options['shop']:
+            raise CommandError("--jsonl-file requires --shop to link the orders to a config")
+
+        since = None
+        if options['since']:
+            try:
+                since = timezone.make_aware(datetime.combine(datetime.strptime(options['since'], '%Y-%m-%d'), time.min))
+            except ValueError:
+                raise CommandError("--since must be formatted as YYYY-MM-DD")
+
+        results = {}
+        for config in self._configs(options['shop']):
+            self.stdout.write(f"Backfilling {config.shop_url}...")
+            results[config.shop_url] = ShopifyOrderService.backfill_store_orders(
+                config, since=since, jsonl_path=jsonl_file
+            )
+        return results
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from domain.models import Product
+from business.products import ProductService
+
+class Command(BaseCommand):
+    help = 'Recompute reserved stock counters from order lines and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Overwrite drifted counters with the recomputed value')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fix = options['fix']
+        batch_size = options['batch_size']
+        self.stdout.write("Verifying reserved stock counters...")
+
+        drift_count = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                products_qs = Product.objects.filter(pk__gt=last_pk).order_by('pk')
+                if fix:
+                    products_qs = products_qs.select_for_update()
+                products = list(products_qs[:batch_size])
+                if not products:
+                    break
+                last_pk = products[-1].pk
+
+                reserved = ProductService.compute_reserved_quantities([p.pk for p in products])
+
+                drifted = []
+                for product in products:
+                    expected = reserved.get(product.pk, 0)
+                    if product.reserved_stock != expected:
+                        self.stdout.write(self.style.WARNING(
+                            f"[{product.sku}] reserved_stock={product.reserved_stock}, expected={expected}"
+                        ))
+                        product.reserved_stock = expected
+                        drifted.append(product)
+
+                drift_count += len(drifted)
+                if fix and drifted:
+                    Product.objects.bulk_update(drifted, ['reserved_stock'])
+                    ProductService.mark_products_as_dirty(p.pk for p in drifted)
+
+        if not drift_count:
+            self.stdout.write(self.style.SUCCESS("No drift detected."))
+        elif fix:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {drift_count} drifted counters."))
+        else:
+            self.stdout.write(self.style.ERROR(f"{drift_count} drifted counters found. Run with --fix to repair."))
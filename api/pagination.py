@@ -0,0 +1,23 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Cursor pagination, newest first. DRF positions the cursor on created_at only:
+    each page is an index range scan from the last created_at seen, and -id just
+    orders the ties. Orders sharing that created_at are skipped with an offset
+    stored in the cursor, so a page boundary inside a large batch of identical
+    timestamps costs a scan over that batch, never over the whole table.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+
+class ProductCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
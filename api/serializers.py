@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from django.db import transaction
 from domain.models import Product, Address, Order, OrderLine
@@ -5,7 +6,25 @@ from domain.models import Product, Address, Order, OrderLine
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ['id', 'sku', 'name', 'physical_stock', 'available_stock', 'pictureUrl']
+        fields = ['id', 'sku', 'name', 'physical_stock', 'available_stock', 'reserved_stock', 'pictureUrl']
+        read_only_fields = ['reserved_stock']
+
+class ProductUpsertSerializer(ProductSerializer):
+    """
+    Row of a bulk upsert: the sku is the key, available_stock defaults to physical - reserved.
+    """
+    class Meta(ProductSerializer.Meta):
+        extra_kwargs = {
+            'sku': {'validators': []},
+            'available_stock': {'required': False},
+        }
+
+class BulkProductUpsertSerializer(serializers.Serializer):
+    products = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=settings.PRODUCT_BULK_UPSERT_MAX_SIZE
+    )
 
 class ProductMiniSerializer(serializers.ModelSerializer):
     class Meta:
@@ -38,5 +57,32 @@ class OrderSerializer(serializers.ModelSerializer):
         read_only_fields = ['status']
 
     def get_total_price(self, obj):
+        # Annotated by OrderViewSet, orders returned by the services are not
+        if hasattr(obj, 'total_price'):
+            return obj.total_price
         total = sum(line.unit_price * line.quantity for line in obj.order_lines.all())
         return total
+
+
+class BulkOrderActionSerializer(serializers.Serializer):
+    order_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=settings.ORDER_BULK_ACTION_MAX_SIZE
+    )
+
+class TrackingSerializer(serializers.Serializer):
+    number = serializers.CharField(required=False, allow_blank=True)
+    carrier = serializers.CharField(required=False, allow_blank=True)
+    url = serializers.URLField(required=False, allow_blank=True)
+
+class BulkShipItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    tracking = TrackingSerializer(required=False)
+
+class BulkShipSerializer(serializers.Serializer):
+    orders = serializers.ListField(
+        child=BulkShipItemSerializer(),
+        allow_empty=False,
+        max_length=settings.ORDER_BULK_ACTION_MAX_SIZE
+    )
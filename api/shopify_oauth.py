@@ -9,7 +9,11 @@ import urllib.parse
 import hashlib
 import hmac
 import base64
+import logging
 from domain.models import ShopifyConfig
+from business.shopify_orders import ShopifyOrderService
+
+logger = logging.getLogger(__name__)
 
 class ShopifyInstallView(APIView):
     permission_classes = [AllowAny]
@@ -78,6 +82,12 @@ class ShopifyCallbackView(APIView):
                 shop_url=shop,
                 defaults={'access_token': access_token}
             )
+
+            try:
+                ShopifyOrderService.register_order_webhooks(config)
+            except Exception as e:
+                # The install itself succeeded, the reconciliation polling covers orders until webhooks are registered
+                logger.error(f"Webhook registration failed for {shop}: {e}")
             
             return Response({
                 'message': 'Auth successful and configuration saved!',
@@ -0,0 +1,72 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+from django.conf import settings
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import AllowAny
+from business.redis_client import get_redis_client
+from business.tasks import process_shopify_order_webhook_task
+
+logger = logging.getLogger(__name__)
+
+class ShopifyOrderWebhookView(APIView):
+    """
+    Receives orders/create, orders/updated and orders/cancelled webhooks.
+    Verifies the HMAC, de-duplicates on the webhook id and queues the payload.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request, topic):
+        # Read the raw body before anything parses it, the HMAC is computed over the exact bytes
+        raw_body = request.body
+
+        hmac_header = request.META.get('HTTP_X_SHOPIFY_HMAC_SHA256')
+        if not hmac_header:
+            return Response({'error': 'No HMAC provided'}, status=401)
+
+        secret = settings.SHOPIFY_API_SECRET.encode('utf-8')
+        digest = base64.b64encode(hmac.new(secret, raw_body, hashlib.sha256).digest()).decode('utf-8')
+
+        if not hmac.compare_digest(digest, hmac_header):
+            return Response({'error': 'Invalid HMAC'}, status=401)
+
+        try:
+            payload = json.loads(raw_body)
+        except ValueError:
+            return Response({'error': 'Invalid JSON'}, status=400)
+
+        shop = request.META.get('HTTP_X_SHOPIFY_SHOP_DOMAIN')
+        webhook_id = request.META.get('HTTP_X_SHOPIFY_WEBHOOK_ID')
+
+        dedup_key = f"shopify:webhook:{webhook_id}" if webhook_id else None
+        if dedup_key and not self._claim(dedup_key):
+            return Response({'status': 'duplicate'})
+
+        try:
+            process_shopify_order_webhook_task.delay(shop, f"orders/{topic}", payload)
+        except Exception as e:
+            logger.error(f"Could not queue webhook {webhook_id} from {shop}: {e}")
+            if dedup_key:
+                self._release(dedup_key)
+            # A non-2xx answer makes Shopify retry the delivery
+            return Response({'error': 'Could not queue webhook'}, status=503)
+
+        return Response({'status': 'queued'})
+
+    def _claim(self, key):
+        try:
+            return bool(get_redis_client().set(key, 1, nx=True, ex=settings.SHOPIFY_WEBHOOK_DEDUP_TTL))
+        except Exception as e:
+            # Better to process a duplicate than to drop a delivery
+            logger.error(f"Webhook de-duplication unavailable: {e}")
+            return True
+
+    def _release(self, key):
+        try:
+            get_redis_client().delete(key)
+        except Exception as e:
+            logger.error(f"Could not release webhook key {key}: {e}")
@@ -1,3 +1,1561 @@
-from django.test import TestCase
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import requests
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.conf import settings
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from micro_oms.celery import app as celery_app
+from domain.models import (
+    Product, Address, Order, OrderLine, ShopifyConfig, ShopifyOrder, ShopifyProduct, FulfillmentOutbox
+)
+from business.fulfillments import FulfillmentService
+from business.tasks import (
+    collect_shop_sync_results, recalculate_inventory_task, sync_shop_orders_task, sync_shopify_orders_task,
+)
+from business.order_repo import OrderRepository
+from business.orders import OrderService
+from business.products import ProductService
+from business.shopify_orders import ShopifyOrderService
+from business.shopify_products import ShopifyProductService
+from business.shopify_async import AsyncShopifyTransport, async_transport_enabled, httpx
+from business.shopify_client import ShopifyClient, ShopifyRateLimiter
 
-# Create your tests here.
+
+@override_settings(MICRO_OMS_API_KEY='test-key')
+class OrderListQueriesTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient(headers={'X-API-KEY': 'test-key'})
+        self.products = [
+            Product.objects.create(sku=f'SKU-{i}', name=f'Product {i}', physical_stock=10, available_stock=10)
+            for i in range(3)
+        ]
+
+    def create_orders(self, count, lines_per_order=3):
+        for i in range(count):
+            address = Address.objects.create(name='Jane', street='1 rue', postal_code='75001', country_code='FR')
+            order = Order.objects.create(
+                reference=f'REF-{Order.objects.count()}', shipping_address=address, customer_email='jane@example.com'
+            )
+            for product in self.products[:lines_per_order]:
+                OrderLine.objects.create(order=order, product=product, quantity=2, unit_price=Decimal('1.50'))
+
+    def test_list_query_count_does_not_grow_with_orders(self):
+        self.create_orders(1)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/orders/')
+        self.assertEqual(response.status_code, 200)
+
+        self.create_orders(10)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/orders/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 11)
+
+    def test_total_price_is_computed_by_the_database(self):
+        self.create_orders(1)
+        self.create_orders(1, lines_per_order=0)
+
+        response = self.client.get('/api/orders/')
+
+        totals = {order['reference']: order['total_price'] for order in response.json()['results']}
+        self.assertEqual(totals, {'REF-0': 9.0, 'REF-1': 0.0})
+
+    def test_detail_uses_the_same_query_plan(self):
+        self.create_orders(1)
+        order = Order.objects.get()
+
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/orders/{order.pk}/')
+
+        self.assertEqual(response.json()['total_price'], 9.0)
+        self.assertEqual(len(response.json()['order_lines']), 3)
+
+
+@override_settings(MICRO_OMS_API_KEY='test-key')
+class CursorPaginationTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient(headers={'X-API-KEY': 'test-key'})
+        address = Address.objects.create(name='Jane', street='1 rue', postal_code='75001', country_code='FR')
+        for i in range(5):
+            Order.objects.create(
+                reference=f'REF-{i}', shipping_address=address, customer_email='jane@example.com',
+                status=Order.Status.SHIPPED if i % 2 else Order.Status.WAITING_PAYMENT
+            )
+
+    def collect_pages(self, url):
+        references = []
+        while url:
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            references.extend(order['reference'] for order in response.json()['results'])
+            url = response.json()['next']
+        return references
+
+    def test_orders_are_paginated_newest_first(self):
+        references = self.collect_pages('/api/orders/?page_size=2')
+
+        self.assertEqual(references, ['REF-4', 'REF-3', 'REF-2', 'REF-1', 'REF-0'])
+
+    def test_pagination_keeps_the_filters(self):
+        references = self.collect_pages('/api/orders/?page_size=1&status=SHIPPED')
+
+        self.assertEqual(references, ['REF-3', 'REF-1'])
+
+    def test_orders_sharing_a_created_at_are_neither_skipped_nor_repeated(self):
+        Order.objects.update(created_at=timezone.now())
+
+        references = self.collect_pages('/api/orders/?page_size=2')
+
+        self.assertEqual(references, ['REF-4', 'REF-3', 'REF-2', 'REF-1', 'REF-0'])
+
+    def test_products_are_paginated_by_id(self):
+        for i in range(3):
+            Product.objects.create(sku=f'SKU-{i}', name=f'Product {i}', physical_stock=1, available_stock=1)
+
+        response = self.client.get('/api/products/?page_size=2')
+        second = self.client.get(response.json()['next'])
+
+        skus = [p['sku'] for p in response.json()['results'] + second.json()['results']]
+        self.assertEqual(skus, ['SKU-0', 'SKU-1', 'SKU-2'])
+        self.assertIsNone(second.json()['next'])
+
+
+class QueryPlanTest(TestCase):
+    """
+    The hot queries must be served by an index, not by a full table scan.
+    """
+
+    def assertUsesIndex(self, queryset, index=None):
+        plan = queryset.explain()
+        self.assertIn('INDEX', plan)
+        if index:
+            self.assertIn(index, plan)
+        return plan
+
+    def test_sku_lookup_uses_the_unique_index(self):
+        plan = self.assertUsesIndex(Product.objects.filter(sku__in=['SKU-1', 'SKU-2']))
+        self.assertIn('sku=?', plan)
+
+    def test_filtered_order_listing_uses_status_index(self):
+        queryset = Order.objects.filter(status__in=['WAITING_PAYMENT', 'TO_BE_PREPARED']).order_by('-created_at', '-id')
+        self.assertUsesIndex(queryset, 'order_status_created_idx')
+
+    def test_order_listing_uses_created_index(self):
+        queryset = Order.objects.filter(created_at__gte=datetime(2026, 1, 1, tzinfo=dt_timezone.utc)).order_by('-created_at', '-id')
+        self.assertUsesIndex(queryset, 'order_created_id_idx')
+
+    def test_reserved_aggregate_uses_covering_index(self):
+        queryset = OrderLine.objects.filter(product_id__in=[1, 2]).exclude(
+            order__status__in=['CANCELED', 'SHIPPED', 'ERROR']
+        ).values('product_id').annotate(total=Sum('quantity'))
+        self.assertUsesIndex(queryset, 'orderline_product_order_idx')
+
+    def test_shopify_order_link_lookup_uses_remote_id_index(self):
+        queryset = ShopifyOrder.objects.filter(config_id=1, shopify_order_id=123)
+        self.assertUsesIndex(queryset, 'shopify_order_remote_id_idx')
+
+
+def shopify_order(number, lines=None, **fields):
+    """
+    Shopify REST order payload, lines are (sku, quantity, price) tuples.
+    """
+    return {
+        'id': 1000 + number,
+        'order_number': number,
+        'email': 'jane@example.com',
+        'financial_status': 'pending',
+        'shipping_address': {'name': 'Jane', 'address1': '1 rue', 'zip': '75001', 'country_code': 'FR'},
+        'line_items': [
+            {'sku': sku, 'quantity': quantity, 'price': price}
+            for sku, quantity, price in (lines or [('SKU-A', 1, '2.50')])
+        ],
+        **fields,
+    }
+
+
+class ShopifyOrderIngestTest(TestCase):
+
+    def setUp(self):
+        self.config = ShopifyConfig.objects.create(shop_url='test.myshopify.com', access_token='token')
+        self.product_a = Product.objects.create(sku='SKU-A', name='A', physical_stock=10, available_stock=10)
+        self.product_b = Product.objects.create(sku='SKU-B', name='B', physical_stock=10, available_stock=10)
+
+    def test_page_is_created_in_bulk(self):
+        stats = ShopifyOrderService._process_orders_batch(
+            [shopify_order(1), shopify_order(2, [('SKU-A', 2, '2.50'), ('SKU-B', 3, '1.00')])], self.config
+        )
+
+        self.assertEqual(stats, {'created': 2, 'updated': 0, 'skipped': 0})
+        self.assertEqual(ShopifyOrder.objects.filter(config=self.config).count(), 2)
+        self.product_a.refresh_from_db()
+        self.assertEqual(self.product_a.reserved_stock, 3)
+
+    def test_bad_order_does_not_block_the_page(self):
+        stats = ShopifyOrderService._process_orders_batch(
+            [shopify_order(1), shopify_order(2, [('SKU-A', None, '2.50')]), shopify_order(3)], self.config
+        )
+
+        self.assertEqual(stats, {'created': 2, 'updated': 0, 'skipped': 0})
+        self.assertEqual(set(Order.objects.values_list('reference', flat=True)), {'1', '3'})
+        self.product_a.refresh_from_db()
+        self.assertEqual(self.product_a.reserved_stock, 2)
+
+    def test_unknown_sku_stores_the_order_in_error(self):
+        ShopifyOrderService._process_orders_batch([shopify_order(1, [('UNKNOWN', 1, '1.00')])], self.config)
+
+        order = Order.objects.get(reference='1')
+        self.assertEqual(order.status, Order.Status.ERROR)
+        self.assertFalse(order.order_lines.exists())
+
+
+ADDRESS = {'name': 'Jane', 'street': '1 rue', 'postal_code': '75001', 'country_code': 'FR'}
+
+
+@override_settings(MICRO_OMS_API_KEY='test-key')
+class ReservedStockCounterTest(TestCase):
+    """
+    Product.reserved_stock must always equal the aggregate over the open order lines.
+    """
+
+    def setUp(self):
+        self.client = APIClient(headers={'X-API-KEY': 'test-key'})
+        self.a = Product.objects.create(sku='SKU-A', name='A', physical_stock=50, available_stock=50)
+        self.b = Product.objects.create(sku='SKU-B', name='B', physical_stock=50, available_stock=50)
+
+    def assertCountersMatch(self):
+        expected = ProductService.compute_reserved_quantities([self.a.pk, self.b.pk])
+        for product in Product.objects.filter(pk__in=[self.a.pk, self.b.pk]):
+            self.assertEqual(product.reserved_stock, expected.get(product.pk, 0), product.sku)
+
+    def reserved(self, product):
+        product.refresh_from_db()
+        return product.reserved_stock
+
+    def create_order(self, reference, lines, status=None):
+        return OrderRepository.create_update_order(
+            reference, ADDRESS,
+            [{'product': product, 'quantity': quantity, 'unit_price': 1} for product, quantity in lines],
+            'jane@example.com', status
+        )
+
+    def test_single_order_lifecycle(self):
+        order = self.create_order('R1', [(self.a, 2), (self.b, 4)])
+        self.assertEqual(self.reserved(self.b), 4)
+        self.assertCountersMatch()
+
+        # Quantity change, removed line
+        self.create_order('R1', [(self.a, 5)])
+        self.assertEqual((self.reserved(self.a), self.reserved(self.b)), (5, 0))
+        self.assertCountersMatch()
+
+        OrderService.confirm_payment(order.pk)
+        self.assertEqual(self.reserved(self.a), 5)
+
+        OrderService.ship_order(order.pk)
+        self.assertEqual(self.reserved(self.a), 0)
+        self.assertEqual(Product.objects.get(pk=self.a.pk).physical_stock, 45)
+        self.assertCountersMatch()
+
+        other = self.create_order('R2', [(self.b, 3)])
+        OrderService.cancel_order(other.pk)
+        self.assertEqual(self.reserved(self.b), 0)
+        self.assertCountersMatch()
+
+    def test_delete_releases_the_reservation(self):
+        order = self.create_order('R1', [(self.b, 4)])
+        self.create_order('R2', [(self.b, 1)])
+
+        response = self.client.delete(f'/api/orders/{order.pk}/')
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.reserved(self.b), 1)
+        Order.objects.filter(reference='R2').delete()
+        self.assertEqual(self.reserved(self.b), 0)
+        self.assertCountersMatch()
+
+    def test_deleting_a_closed_order_changes_nothing(self):
+        self.create_order('R1', [(self.b, 4)])
+        closed = self.create_order('R2', [(self.b, 2)], Order.Status.CANCELED)
+
+        closed.delete()
+
+        self.assertEqual(self.reserved(self.b), 4)
+        self.assertCountersMatch()
+
+    def test_bulk_paths(self):
+        payloads = [
+            {
+                'reference': f'R{i}', 'shipping_address_data': ADDRESS, 'customer_email': 'jane@example.com',
+                'order_lines_data': [{'product': self.a, 'quantity': i, 'unit_price': 1}],
+            }
+            for i in range(1, 5)
+        ]
+        orders, _ = OrderRepository.bulk_create_update_orders(payloads)
+        self.assertEqual(self.reserved(self.a), 10)
+
+        payloads[0]['order_lines_data'] = [{'product': self.b, 'quantity': 7, 'unit_price': 1}]
+        payloads[1]['status'] = Order.Status.CANCELED
+        OrderRepository.bulk_create_update_orders(payloads)
+        self.assertEqual((self.reserved(self.a), self.reserved(self.b)), (7, 7))
+        self.assertCountersMatch()
+
+        ids = [orders[f'R{i}'].pk for i in range(1, 5)]
+        OrderService.bulk_confirm_payment(ids)
+        OrderService.bulk_ship_orders(ids[:3])
+        self.assertEqual((self.reserved(self.a), self.reserved(self.b)), (4, 0))
+        self.assertCountersMatch()
+
+        OrderService.bulk_cancel_orders(ids)
+        self.assertEqual(self.reserved(self.a), 0)
+        self.assertCountersMatch()
+
+
+def set_quantities_response(user_errors=(), applied=False):
+    group = {'changes': [{'quantityAfterChange': 1}]} if applied else None
+    return {'data': {'inventorySetQuantities': {'inventoryAdjustmentGroup': group, 'userErrors': list(user_errors)}}}
+
+
+class InventoryPushTest(TestCase):
+
+    def setUp(self):
+        self.config = ShopifyConfig.objects.create(shop_url='test.myshopify.com', access_token='token', location_id=1)
+        self.items = []
+        for i, sku in enumerate(['SKU-A', 'SKU-B', 'SKU-C']):
+            product = Product.objects.create(sku=sku, name=sku, physical_stock=5, available_stock=5)
+            link = ShopifyProduct.objects.create(config=self.config, product=product, inventory_item_id=i + 1)
+            self.items.append((link, 5))
+
+    def push(self, *responses):
+        with mock.patch.object(ShopifyClient, 'graphql', side_effect=list(responses)) as graphql:
+            results = ShopifyProductService._set_quantities(self.config, 1, self.items)
+        return results, graphql
+
+    def test_rejected_item_fails_the_mutation_and_the_others_are_sent_again(self):
+        error = {'field': ['input', 'quantities', '1', 'inventoryItemId'], 'message': 'Not stocked'}
+
+        results, graphql = self.push(set_quantities_response([error]), set_quantities_response(applied=True))
+
+        self.assertEqual(results, {'SKU-A': True, 'SKU-B': False, 'SKU-C': True})
+        retried = graphql.call_args_list[1].args[1]['input']['quantities']
+        self.assertEqual([q['inventoryItemId'] for q in retried], ['gid://shopify/InventoryItem/1', 'gid://shopify/InventoryItem/3'])
+
+    def test_error_without_item_index_fails_the_whole_chunk(self):
+        results, graphql = self.push(set_quantities_response([{'field': ['input'], 'message': 'Bad input'}]))
+
+        self.assertEqual(results, {'SKU-A': False, 'SKU-B': False, 'SKU-C': False})
+        self.assertEqual(graphql.call_count, 1)
+
+    def test_failed_retry_is_not_retried_again(self):
+        error = {'field': ['input', 'quantities', '0', 'inventoryItemId'], 'message': 'Not stocked'}
+
+        results, graphql = self.push(set_quantities_response([error]), set_quantities_response([error]))
+
+        self.assertEqual(results, {'SKU-A': False, 'SKU-B': False, 'SKU-C': False})
+        self.assertEqual(graphql.call_count, 2)
+
+    def test_failed_items_are_not_recorded_as_pushed(self):
+        error = {'field': ['input', 'quantities', '1', 'inventoryItemId'], 'message': 'Not stocked'}
+        products = [link.product for link, _ in self.items]
+
+        with mock.patch.object(ShopifyClient, 'graphql', side_effect=[
+            set_quantities_response([error]), set_quantities_response(applied=True)
+        ]):
+            ShopifyProductService.push_inventory_batch(products, configs=[self.config])
+
+        pushed = dict(ShopifyProduct.objects.values_list('product__sku', 'last_pushed_quantity'))
+        self.assertEqual(pushed, {'SKU-A': 5, 'SKU-B': None, 'SKU-C': 5})
+
+
+@override_settings(MICRO_OMS_API_KEY='test-key')
+class ProductBulkUpsertTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient(headers={'X-API-KEY': 'test-key'})
+        self.existing = Product.objects.create(
+            sku='ABC', name='Existing', physical_stock=10, available_stock=7, reserved_stock=3, pictureUrl='a.png'
+        )
+        Product.objects.create(sku='123', name='Numeric', physical_stock=1, available_stock=1, pictureUrl='b.png')
+
+    def upsert(self, *rows):
+        response = self.client.post('/api/products/bulk-upsert/', {'products': list(rows)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_partial_update_keeps_other_fields_and_follows_reserved_stock(self):
+        results = self.upsert({'sku': 'ABC', 'physical_stock': 20})
+
+        self.assertEqual(results, [{'index': 0, 'sku': 'ABC', 'status': 'updated'}])
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.name, self.existing.physical_stock, self.existing.available_stock), ('Existing', 20, 17))
+
+    def test_sku_is_normalized_before_matching(self):
+        results = self.upsert({'sku': 'ABC ', 'physical_stock': 20}, {'sku': 123, 'physical_stock': 4})
+
+        self.assertEqual([(r['sku'], r['status']) for r in results], [('ABC', 'updated'), ('123', 'updated')])
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_invalid_rows_are_reported_without_failing_the_batch(self):
+        results = self.upsert(
+            {'sku': 'NEW', 'name': 'New', 'physical_stock': 5, 'pictureUrl': 'c.png'},
+            {'sku': 'BAD', 'physical_stock': 'many'},
+            {'physical_stock': 3},
+        )
+
+        self.assertEqual(results[0], {'index': 0, 'sku': 'NEW', 'status': 'created'})
+        self.assertIn('physical_stock', results[1]['errors'])
+        self.assertIn('sku', results[2]['errors'])
+        self.assertEqual(Product.objects.get(sku='NEW').available_stock, 5)
+        self.assertFalse(Product.objects.filter(sku='BAD').exists())
+
+    def test_duplicate_skus_are_errors(self):
+        results = self.upsert({'sku': 'ABC', 'physical_stock': 1}, {'sku': ' ABC', 'physical_stock': 2})
+
+        self.assertTrue(all('errors' in result for result in results))
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.physical_stock, 10)
+
+    def test_unchanged_rows_are_reported(self):
+        results = self.upsert({'sku': 'ABC', 'physical_stock': 10})
+
+        self.assertEqual(results[0]['status'], 'unchanged')
+
+
+class DirtyMarkBufferTest(TestCase):
+
+    def setUp(self):
+        transaction.get_connection()._inventory_dirty_buffer = set()
+
+    def flushed_marks(self, work):
+        flushed = []
+        with mock.patch.object(ProductService, '_flush_dirty_products', side_effect=lambda ids: flushed.append(set(ids))):
+            with self.captureOnCommitCallbacks(execute=True):
+                work()
+        return set().union(*flushed) if flushed else set()
+
+    def test_marks_of_a_rolled_back_savepoint_are_flushed_with_the_outer_transaction(self):
+        def work():
+            with transaction.atomic():
+                with transaction.atomic():
+                    ProductService.mark_products_as_dirty([1])
+                try:
+                    with transaction.atomic():
+                        ProductService.mark_products_as_dirty([2])
+                        raise ValueError
+                except ValueError:
+                    pass
+                ProductService.mark_products_as_dirty([3])
+
+        # A spurious mark is harmless, a lost one would leave stale stock
+        self.assertEqual(self.flushed_marks(work), {1, 2, 3})
+
+    def test_rolled_back_block_alone_flushes_nothing(self):
+        def work():
+            try:
+                with transaction.atomic():
+                    ProductService.mark_products_as_dirty([1])
+                    raise ValueError
+            except ValueError:
+                pass
+
+        self.assertEqual(self.flushed_marks(work), set())
+
+    def test_marks_made_only_inside_a_released_savepoint_are_flushed(self):
+        def work():
+            with transaction.atomic():
+                with transaction.atomic():
+                    ProductService.mark_products_as_dirty([1])
+
+        self.assertEqual(self.flushed_marks(work), {1})
+
+    def test_marks_are_deduplicated_per_transaction(self):
+        flushed = []
+
+        def work():
+            with transaction.atomic():
+                ProductService.mark_products_as_dirty([1, 2])
+                ProductService.mark_products_as_dirty([2, 3])
+
+        with mock.patch.object(ProductService, '_flush_dirty_products', side_effect=lambda ids: flushed.append(sorted(ids))):
+            with self.captureOnCommitCallbacks(execute=True):
+                work()
+        self.assertEqual(flushed, [[1, 2, 3]])
+
+
+class ShopifyOrderChangeDetectionTest(TestCase):
+
+    def setUp(self):
+        self.config = ShopifyConfig.objects.create(shop_url='test.myshopify.com', access_token='token')
+        self.a = Product.objects.create(sku='SKU-A', name='A', physical_stock=10, available_stock=10)
+        self.b = Product.objects.create(sku='SKU-B', name='B', physical_stock=10, available_stock=10)
+        self.c = Product.objects.create(sku='SKU-C', name='C', physical_stock=10, available_stock=10)
+
+    def ingest(self, *orders):
+        return ShopifyOrderService._process_orders_batch(list(orders), self.config)
+
+    def test_unchanged_orders_are_skipped(self):
+        page = [shopify_order(1), shopify_order(2)]
+        self.ingest(*page)
+
+        with self.assertNumQueries(2):
+            stats = self.ingest(*page)
+
+        self.assertEqual(stats, {'created': 0, 'updated': 0, 'skipped': 2})
+
+    def test_changed_order_is_updated_and_its_hash_refreshed(self):
+        self.ingest(shopify_order(1))
+        old_hash = ShopifyOrder.objects.get().content_hash
+
+        stats = self.ingest(shopify_order(1, financial_status='paid'))
+
+        self.assertEqual(stats, {'created': 0, 'updated': 1, 'skipped': 0})
+        self.assertEqual(Order.objects.get().status, Order.Status.TO_BE_PREPARED)
+        self.assertNotEqual(ShopifyOrder.objects.get().content_hash, old_hash)
+
+    def test_lines_are_diffed_by_product(self):
+        self.ingest(shopify_order(1, [('SKU-A', 2, '1.00'), ('SKU-B', 1, '1.00')]))
+        line_a = OrderLine.objects.get(product=self.a)
+
+        self.ingest(shopify_order(1, [('SKU-A', 3, '1.00'), ('SKU-C', 4, '1.00')]))
+
+        lines = {line.product_id: line for line in OrderLine.objects.all()}
+        self.assertEqual(set(lines), {self.a.pk, self.c.pk})
+        # Kept in place, not deleted and recreated
+        self.assertEqual(lines[self.a.pk].pk, line_a.pk)
+        self.assertEqual(lines[self.a.pk].quantity, 3)
+        reserved = dict(Product.objects.values_list('sku', 'reserved_stock'))
+        self.assertEqual(reserved, {'SKU-A': 3, 'SKU-B': 0, 'SKU-C': 4})
+
+    def test_price_change_alone_updates_the_line(self):
+        self.ingest(shopify_order(1, [('SKU-A', 2, '1.00')]))
+
+        self.ingest(shopify_order(1, [('SKU-A', 2, '1.25')]))
+
+        self.assertEqual(OrderLine.objects.get().unit_price, Decimal('1.25'))
+
+
+@override_settings(FULFILLMENT_OUTBOX_MAX_ATTEMPTS=3, FULFILLMENT_OUTBOX_BASE_DELAY=30, FULFILLMENT_OUTBOX_MAX_DELAY=45)
+class FulfillmentOutboxTest(TestCase):
+
+    def setUp(self):
+        self.config = ShopifyConfig.objects.create(shop_url='test.myshopify.com', access_token='token')
+        product = Product.objects.create(sku='SKU-A', name='A', physical_stock=10, available_stock=10)
+        address = Address.objects.create(**ADDRESS)
+        self.order = Order.objects.create(
+            reference='R1', shipping_address=address, customer_email='jane@example.com', status=Order.Status.TO_BE_PREPARED
+        )
+        OrderLine.objects.create(order=self.order, product=product, quantity=1, unit_price=1)
+        ShopifyOrder.objects.create(config=self.config, order=self.order, shopify_order_id=1)
+
+    def entry(self, **fields):
+        return FulfillmentOutbox.objects.create(order=self.order, **fields)
+
+    def dispatch(self, entry, delivered=True):
+        fulfill = mock.patch.object(
+            ShopifyOrderService, 'fulfill_order',
+            side_effect=delivered if isinstance(delivered, Exception) else None, return_value=delivered
+        )
+        with fulfill:
+            status = FulfillmentService.dispatch(entry.pk)
+        entry.refresh_from_db()
+        return status
+
+    def test_shipping_writes_the_entry_and_schedules_it_on_commit(self):
+        with mock.patch.object(FulfillmentService, '_schedule') as schedule, \
+                mock.patch.object(ProductService, '_flush_dirty_products'):
+            with self.captureOnCommitCallbacks(execute=True):
+                OrderService.ship_order(self.order.pk, {'number': 'TRACK', 'carrier': '', 'extra': 'x'})
+
+        entry = FulfillmentOutbox.objects.get()
+        self.assertEqual(entry.tracking, {'number': 'TRACK'})
+        schedule.assert_called_once_with(entry.pk)
+
+    def test_orders_without_shopify_link_have_nothing_to_fulfill(self):
+        ShopifyOrder.objects.all().delete()
+
+        OrderService.ship_order(self.order.pk)
+
+        self.assertFalse(FulfillmentOutbox.objects.exists())
+
+    def test_delivered_entry_is_sent(self):
+        entry = self.entry()
+
+        self.assertEqual(self.dispatch(entry), FulfillmentOutbox.Status.SENT)
+        self.assertEqual(entry.attempts, 1)
+
+    def test_failed_delivery_backs_off(self):
+        entry = self.entry()
+
+        before = timezone.now()
+        self.assertEqual(self.dispatch(entry, RuntimeError('boom')), FulfillmentOutbox.Status.PENDING)
+        self.assertEqual((entry.attempts, entry.last_error), (1, 'boom'))
+        self.assertGreaterEqual(entry.next_attempt_at, before + timedelta(seconds=30))
+
+        self.dispatch(entry, False)
+        # Capped by FULFILLMENT_OUTBOX_MAX_DELAY
+        self.assertLess(entry.next_attempt_at, timezone.now() + timedelta(seconds=46))
+
+    def test_entry_is_dead_lettered_after_max_attempts(self):
+        entry = self.entry(attempts=2)
+
+        self.assertEqual(self.dispatch(entry, False), FulfillmentOutbox.Status.DEAD)
+        self.assertEqual(entry.attempts, 3)
+        # Dead and sent entries are never delivered again
+        self.assertIsNone(self.dispatch(entry))
+
+    def test_sweep_only_delivers_due_entries(self):
+        self.entry()
+        self.entry(next_attempt_at=timezone.now() + timedelta(hours=1))
+
+        with mock.patch.object(ShopifyOrderService, 'fulfill_order', return_value=True):
+            stats = FulfillmentService.dispatch_due()
+
+        self.assertEqual(stats, {'SENT': 1})
+        self.assertEqual(FulfillmentOutbox.objects.filter(status=FulfillmentOutbox.Status.PENDING).count(), 1)
+
+
+@override_settings(MICRO_OMS_API_KEY='test-key')
+class BulkOrderTransitionTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient(headers={'X-API-KEY': 'test-key'})
+        self.config = ShopifyConfig.objects.create(shop_url='test.myshopify.com', access_token='token')
+        # Reserved by the two open orders below
+        self.product = Product.objects.create(sku='SKU-A', name='A', physical_stock=10, available_stock=6, reserved_stock=4)
+        address = Address.objects.create(**ADDRESS)
+        self.orders = {}
+        for status in [Order.Status.WAITING_PAYMENT, Order.Status.TO_BE_PREPARED, Order.Status.SHIPPED]:
+            order = Order.objects.create(
+                reference=status, shipping_address=address, customer_email='jane@example.com', status=status
+            )
+            OrderLine.objects.create(order=order, product=self.product, quantity=2, unit_price=1)
+            self.orders[status] = order.pk
+
+    def post(self, action, data):
+        return self.client.post(f'/api/orders/{action}/', data, format='json')
+
+    def test_results_are_reported_per_id(self):
+        waiting = self.orders[Order.Status.WAITING_PAYMENT]
+        shipped = self.orders[Order.Status.SHIPPED]
+
+        response = self.post('bulk-pay', {'order_ids': [waiting, shipped, 999, waiting]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [
+            {'id': waiting, 'status': 'TO_BE_PREPARED'},
+            {'id': shipped, 'error': 'Cannot confirm payment for order in status SHIPPED'},
+            {'id': 999, 'error': 'Order not found'},
+        ])
+        self.assertEqual(Order.objects.get(pk=shipped).status, Order.Status.SHIPPED)
+
+    def test_bulk_ship_decrements_stock_and_writes_the_outbox(self):
+        prepared = self.orders[Order.Status.TO_BE_PREPARED]
+        waiting = self.orders[Order.Status.WAITING_PAYMENT]
+        ShopifyOrder.objects.create(config=self.config, order_id=prepared, shopify_order_id=1)
+
+        with mock.patch.object(FulfillmentService, '_schedule_sweep') as sweep, \
+                mock.patch.object(ProductService, '_flush_dirty_products'):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.post('bulk-ship', {'orders': [
+                    {'id': prepared, 'tracking': {'number': 'TRACK'}},
+                    {'id': waiting},
+                ]})
+
+        results = response.json()['results']
+        self.assertEqual(results[0], {'id': prepared, 'status': 'SHIPPED'})
+        self.assertIn('error', results[1])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.physical_stock, 8)
+        self.assertEqual(FulfillmentOutbox.objects.get().tracking, {'number': 'TRACK'})
+        sweep.assert_called_once()
+
+    def test_bulk_cancel_refuses_shipped_orders(self):
+        response = self.post('bulk-cancel', {'order_ids': list(self.orders.values())})
+
+        statuses = dict(Order.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[self.orders[Order.Status.SHIPPED]], Order.Status.SHIPPED)
+        self.assertEqual(
+            sum('error' in result for result in response.json()['results']), 1
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, 0)
+
+    def test_empty_payload_is_rejected(self):
+        self.assertEqual(self.post('bulk-pay', {'order_ids': []}).status_code, 400)
+        self.assertEqual(self.post('bulk-ship', {'orders': [{'tracking': {}}]}).status_code, 400)
+
+
+class FakeRedis:
+    """
+    In-memory stand-in for the few redis-py commands the services use, remembers the TTLs.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value).encode()
+        self.ttls[key] = ex
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+            self.ttls.pop(key, None)
+
+    def sadd(self, key, *members):
+        self.data.setdefault(key, set()).update(str(member).encode() for member in members)
+
+    def scard(self, key):
+        return len(self.data.get(key, ()))
+
+    def spop(self, key, count=1):
+        members = self.data.get(key, set())
+        return [members.pop() for _ in range(min(count, len(members)))]
+
+    def pipeline(self, transaction=True):
+        # Commands apply right away, execute() only has to exist
+        return self
+
+    def execute(self):
+        return []
+
+    def eval(self, script, numkeys, key, token):
+        # Only the compare-and-delete lock release script is used
+        if self.data.get(key) == str(token).encode():
+            self.delete(key)
+            return 1
+        return 0
+
+
+def shopify_hmac(body, secret='webhook-secret'):
+    return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+
+@override_settings(SHOPIFY_API_SECRET='webhook-secret')
+class ShopifyOrderWebhookTest(TestCase):
+    url = '/api/shopify/webhooks/orders/create/'
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch('api.shopify_webhooks.get_redis_client', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        task_patcher = mock.patch('api.shopify_webhooks.process_shopify_order_webhook_task')
+        self.task = task_patcher.start()
+        self.addCleanup(task_patcher.stop)
+
+    def deliver(self, body=b'{"id": 1, "order_number": 1}', signature=None, webhook_id='wh-1'):
+        headers = {'HTTP_X_SHOPIFY_SHOP_DOMAIN': 'test.myshopify.com', 'HTTP_X_SHOPIFY_WEBHOOK_ID': webhook_id}
+        if signature is not False:
+            headers['HTTP_X_SHOPIFY_HMAC_SHA256'] = signature or shopify_hmac(body)
+        return self.client.post(self.url, data=body, content_type='application/json', **headers)
+
+    def test_valid_webhook_is_queued_once(self):
+        response = self.deliver()
+
+        self.assertEqual(response.status_code, 200)
+        self.task.delay.assert_called_once_with('test.myshopify.com', 'orders/create', {'id': 1, 'order_number': 1})
+
+    def test_missing_or_bad_hmac_is_rejected(self):
+        self.assertEqual(self.deliver(signature=False).status_code, 401)
+        self.assertEqual(self.deliver(signature=shopify_hmac(b'other body')).status_code, 401)
+        self.task.delay.assert_not_called()
+
+    def test_duplicate_delivery_is_dropped(self):
+        self.deliver()
+        response = self.deliver()
+
+        self.assertEqual(response.json(), {'status': 'duplicate'})
+        self.assertEqual(self.task.delay.call_count, 1)
+        self.assertEqual(self.redis.ttls['shopify:webhook:wh-1'], 86400)
+
+    def test_queueing_failure_answers_503_and_releases_the_claim(self):
+        self.task.delay.side_effect = ConnectionError('broker down')
+
+        response = self.deliver()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertNotIn('shopify:webhook:wh-1', self.redis.data)
+
+        # Shopify's retry goes through once the broker is back
+        self.task.delay.side_effect = None
+        self.assertEqual(self.deliver().json(), {'status': 'queued'})
+
+
+@override_settings(SHOPIFY_API_SECRET='webhook-secret')
+class ShopifyCallbackTest(TestCase):
+
+    def callback(self):
+        params = {'code': 'auth-code', 'shop': 'test.myshopify.com', 'timestamp': '1'}
+        message = '&'.join(f"{k}={v}" for k, v in sorted(params.items()))
+        params['hmac'] = hmac.new(b'webhook-secret', message.encode(), hashlib.sha256).hexdigest()
+        token_response = mock.Mock(status_code=200)
+        token_response.json.return_value = {'access_token': 'token'}
+        with mock.patch('api.shopify_oauth.requests.post', return_value=token_response):
+            return self.client.get('/api/shopify/callback/', params)
+
+    def test_webhook_registration_failure_does_not_fail_the_install(self):
+        with mock.patch.object(ShopifyOrderService, 'register_order_webhooks', side_effect=ConnectionError('timeout')):
+            response = self.callback()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ShopifyConfig.objects.get().access_token, 'token')
+
+
+class WebhookRegistrationTest(TestCase):
+
+    def setUp(self):
+        self.config = ShopifyConfig.objects.create(shop_url='test.myshopify.com', access_token='token')
+
+    @override_settings(SHOPIFY_WEBHOOK_BASE_URL=None)
+    def test_registration_is_skipped_without_a_base_url(self):
+        with mock.patch.object(ShopifyOrderService, '_graphql_request') as graphql:
+            self.assertEqual(ShopifyOrderService.register_order_webhooks(self.config), 0)
+        graphql.assert_not_called()
+
+    @override_settings(SHOPIFY_WEBHOOK_BASE_URL='https://oms.example.com/api/shopify/webhooks')
+    def test_every_topic_is_registered(self):
+        created = {'data': {'webhookSubscriptionCreate': {'webhookSubscription': {'id': 'gid'}, 'userErrors': []}}}
+        with mock.patch.object(ShopifyOrderService, '_graphql_request', return_value=created) as graphql:
+            self.assertEqual(ShopifyOrderService.register_order_webhooks(self.config), 3)
+
+        urls = [call.args[2]['subscription']['callbackUrl'] for call in graphql.call_args_list]
+        self.assertIn('https://oms.example.com/api/shopify/webhooks/orders/cancelled/', urls)
+
+
+class FakeClock:
+    """
+    Replaces the time module of business.shopify_client: sleeping advances the clock.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds:
+            self.sleeps.append(round(seconds, 3))
+        self.now += seconds
+
+
+def fake_response(status_code=200, data=None, headers=None):
+    response = mock.Mock(status_code=status_code, headers=headers or {})
+    response.json.return_value = data or {}
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(f"{status_code} error")
+    return response
+
+
+class ShopifyRateLimiterTest(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('business.shopify_client.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_wait_once_the_bucket_is_empty(self):
+        limiter = ShopifyRateLimiter(capacity=40, restore_rate=2)
+
+        waits = [limiter.reserve(1) for _ in range(42)]
+
+        self.assertEqual(waits[:40], [0] * 40)
+        # Each extra call waits for its own leak: 1/2s, then 2/2s
+        self.assertEqual(waits[40:], [0.5, 1.0])
+
+    def test_bucket_refills_with_time(self):
+        limiter = ShopifyRateLimiter(capacity=1000, restore_rate=50)
+        limiter.reserve(1000)
+
+        self.clock.now += 4
+        self.assertEqual(limiter.wait_for(300), 2.0)
+        self.assertEqual(limiter.reserve(200), 0)
+
+    def test_server_status_resynchronizes_the_bucket(self):
+        limiter = ShopifyRateLimiter(capacity=1000, restore_rate=50)
+
+        limiter.update(100, capacity=2000, restore_rate=100)
+
+        self.assertEqual((limiter.capacity, limiter.restore_rate), (2000, 100))
+        self.assertEqual(limiter.reserve(300), 2.0)
+
+    def test_cost_above_capacity_is_capped(self):
+        limiter = ShopifyRateLimiter(capacity=40, restore_rate=2)
+
+        self.assertEqual(limiter.reserve(100), 0)
+        self.assertEqual(limiter.wait_for(100), 20.0)
+
+
+@override_settings(SHOPIFY_MAX_RETRIES=2, SHOPIFY_RETRY_BASE_DELAY=1.0, SHOPIFY_RETRY_MAX_DELAY=30.0)
+class ShopifyClientRetryTest(TestCase):
+    query = 'query { shop { name } }'
+
+    def setUp(self):
+        self.clock = FakeClock()
+        for target, value in [
+            ('business.shopify_client.time', self.clock),
+            # Full jitter pinned to its upper bound
+            ('business.shopify_client.random.uniform', lambda low, high: high),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client_ = ShopifyClient('test.myshopify.com', 'token')
+        self.client_.session = mock.Mock()
+
+    def test_429_is_retried_after_retry_after_plus_jitter(self):
+        self.client_.session.post.side_effect = [
+            fake_response(429, headers={'Retry-After': '2'}),
+            fake_response(429, headers={'Retry-After': '2'}),
+            fake_response(data={'data': {'shop': {'name': 'Test'}}}),
+        ]
+
+        data = self.client_.graphql(self.query)
+
+        self.assertEqual(data['data']['shop']['name'], 'Test')
+        self.assertEqual(self.client_.session.post.call_count, 3)
+        # Retry-After + base delay * 2 ** attempt
+        self.assertEqual(self.clock.sleeps, [3.0, 4.0])
+
+    def test_error_is_raised_once_retries_run_out(self):
+        self.client_.session.post.return_value = fake_response(429)
+
+        with self.assertRaises(requests.HTTPError):
+            self.client_.graphql(self.query)
+
+        self.assertEqual(self.client_.session.post.call_count, 3)
+
+    def test_throttled_graphql_waits_for_the_bucket(self):
+        throttled = {
+            'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}],
+            'extensions': {'cost': {
+                'requestedQueryCost': 100,
+                'throttleStatus': {'maximumAvailable': 1000, 'currentlyAvailable': 0, 'restoreRate': 50},
+            }},
+        }
+        self.client_.session.post.side_effect = [fake_response(data=throttled), fake_response(data={'data': {}})]
+
+        self.assertEqual(self.client_.graphql(self.query), {'data': {}})
+        # The 50 points estimated for this call at 50/s, plus the jitter of the first attempt
+        self.assertEqual(self.clock.sleeps, [2.0])
+        # The next call reserves the real cost reported by Shopify
+        self.assertEqual(self.client_.estimated_cost(self.query), 100)
+
+    def test_throttled_response_is_returned_once_retries_run_out(self):
+        throttled = {'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}]}
+        self.client_.session.post.return_value = fake_response(data=throttled)
+
+        data = self.client_.graphql(self.query)
+
+        self.assertTrue(ShopifyClient.is_throttled(data))
+        self.assertEqual(self.client_.session.post.call_count, 3)
+
+    def test_rest_calls_follow_the_call_limit_header(self):
+        self.client_.session.get.side_effect = [
+            fake_response(headers={'X-Shopify-Shop-Api-Call-Limit': '39/40'}),
+            fake_response(headers={'X-Shopify-Shop-Api-Call-Limit': '40/40'}),
+            fake_response(headers={'X-Shopify-Shop-Api-Call-Limit': '40/40'}),
+        ]
+
+        self.client_.get('orders.json')
+        self.client_.get('orders.json')
+        self.client_.get('orders.json')
+
+        # The bucket is full after the second response, the third call waits for one leak
+        self.assertEqual(self.clock.sleeps, [0.5])
+
+
+class InventoryDrainTaskTest(TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        for target, value in [
+            ('business.tasks.get_redis_client', mock.Mock(return_value=self.redis)),
+            ('business.shopify_products.ShopifyProductService.push_inventory_batch', mock.Mock(return_value={})),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.product = Product.objects.create(sku='SKU-A', name='A', physical_stock=10, available_stock=0, reserved_stock=4)
+
+    def mark_dirty(self):
+        self.redis.sadd(settings.REDIS_INVENTORY_DIRTY_SET_KEY, self.product.pk)
+
+    def test_dirty_products_are_recalculated_and_the_lock_released(self):
+        self.mark_dirty()
+
+        self.assertEqual(recalculate_inventory_task(), 'Processed 1 products.')
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 6)
+        self.assertNotIn(settings.INVENTORY_DRAIN_LOCK_KEY, self.redis.data)
+
+    def test_held_lock_skips_the_run(self):
+        self.mark_dirty()
+        self.redis.set(settings.INVENTORY_DRAIN_LOCK_KEY, 'other-worker')
+
+        self.assertEqual(recalculate_inventory_task(), 'Inventory drain already running.')
+        self.assertEqual(self.redis.scard(settings.REDIS_INVENTORY_DIRTY_SET_KEY), 1)
+        self.assertEqual(self.redis.get(settings.INVENTORY_DRAIN_LOCK_KEY), b'other-worker')
+
+    def test_failed_batch_is_put_back(self):
+        self.mark_dirty()
+
+        with mock.patch.object(ProductService, 'recalculate_inventory_bulk', side_effect=RuntimeError('db down')):
+            self.assertEqual(recalculate_inventory_task(), 'Error: db down')
+
+        self.assertEqual(self.redis.scard(settings.REDIS_INVENTORY_DIRTY_SET_KEY), 1)
+        self.assertNotIn(settings.INVENTORY_DRAIN_LOCK_KEY, self.redis.data)
+
+    def test_lock_release_failure_does_not_fail_the_drain(self):
+        self.mark_dirty()
+
+        with mock.patch.object(self.redis, 'eval', side_effect=ConnectionError('Redis is down')):
+            self.assertEqual(recalculate_inventory_task(), 'Processed 1 products.')
+
+    def test_redis_outage_is_reported_not_raised(self):
+        client = mock.Mock()
+        client.set.side_effect = ConnectionError('Redis is down')
+
+        with mock.patch('business.tasks.get_redis_client', return_value=client):
+            result = recalculate_inventory_task()
+
+        self.assertEqual(result, 'Error: Redis is down')
+
+    @override_settings(INVENTORY_DRAIN_TIME_BUDGET=0)
+    def test_spent_budget_reschedules_the_drain(self):
+        self.mark_dirty()
+
+        with mock.patch.object(recalculate_inventory_task, 'apply_async') as apply_async:
+            recalculate_inventory_task()
+
+        apply_async.assert_called_once()
+        self.assertEqual(self.redis.scard(settings.REDIS_INVENTORY_DIRTY_SET_KEY), 1)
+
+
+def bulk_order_rows(number, lines):
+    order_gid = f'gid://shopify/Order/{1000 + number}'
+    yield {
+        'id': order_gid,
+        'legacyResourceId': str(1000 + number),
+        'name': f'#{number}',
+        'email': 'jane@example.com',
+        'cancelledAt': None,
+        'displayFinancialStatus': 'PAID',
+        'displayFulfillmentStatus': 'UNFULFILLED',
+        'shippingAddress': {'name': 'Jane', 'address1': '1 rue', 'zip': '75001', 'countryCodeV2': 'FR'},
+    }
+    for index, (sku, quantity, price) in enumerate(lines):
+        yield {
+            'id': f'gid://shopify/LineItem/{1000 + number}{index}',
+            'sku': sku,
+            'quantity': quantity,
+            'originalUnitPriceSet': {'shopMoney': {'amount': price}},
+            '__parentId': order_gid,
+        }
+
+
+class ShopifyBackfillTest(TestCase):
+
+    def setUp(self):
+        self.config = ShopifyConfig.objects.create(shop_url='test.myshopify.com', access_token='token')
+        self.product_a = Product.objects.create(sku='SKU-A', name='A', physical_stock=10, available_stock=10)
+        self.product_b = Product.objects.create(sku='SKU-B', name='B', physical_stock=10, available_stock=10)
+
+    def write_jsonl(self, rows):
+        jsonl_file = tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False)
+        self.addCleanup(os.remove, jsonl_file.name)
+        with jsonl_file:
+            for row in rows:
+                jsonl_file.write(json.dumps(row) + '\n')
+        return jsonl_file.name
+
+    def test_jsonl_file_is_ingested_with_its_lines(self):
+        path = self.write_jsonl([
+            *bulk_order_rows(1, [('SKU-A', 2, '2.50'), ('SKU-B', 1, '4.00')]),
+            *bulk_order_rows(2, [('SKU-B', 3, '1.00')]),
+        ])
+
+        call_command('sync_shopify_orders', jsonl_file=path, shop=self.config.shop_url, stdout=StringIO())
+
+        order = Order.objects.get(reference='1')
+        self.assertEqual(
+            sorted(order.order_lines.values_list('product__sku', 'quantity', 'unit_price')),
+            [('SKU-A', 2, Decimal('2.50')), ('SKU-B', 1, Decimal('4.00'))],
+        )
+        self.assertEqual(list(Order.objects.get(reference='2').order_lines.values_list('quantity', flat=True)), [3])
+        self.assertEqual(ShopifyOrder.objects.filter(config=self.config).count(), 2)
+        self.product_b.refresh_from_db()
+        self.assertEqual(self.product_b.reserved_stock, 4)
+        # A replayed file does not move the incremental sync cursor
+        self.config.refresh_from_db()
+        self.assertIsNone(self.config.last_sync_at)
+
+    def test_child_rows_without_their_parent_are_dropped_and_logged(self):
+        rows = list(bulk_order_rows(1, [('SKU-A', 1, '2.50')]))
+        stray = list(bulk_order_rows(2, [('SKU-B', 5, '1.00')]))[1]
+        path = self.write_jsonl(rows + [stray])
+
+        with self.assertLogs('business.shopify_orders', 'WARNING') as logs:
+            stats = ShopifyOrderService.backfill_store_orders(self.config, jsonl_path=path)
+
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(list(Order.objects.get(reference='1').order_lines.values_list('quantity', flat=True)), [1])
+        self.assertIn('Dropped 1 bulk rows without a matching parent order', logs.output[-1])
+
+
+class ShopifyOrderSyncTest(TestCase):
+    next_url = 'https://test.myshopify.com/admin/api/2024-01/orders.json?limit=250&page_info=abc'
+
+    def setUp(self):
+        self.last_sync_at = timezone.now() - timedelta(days=1)
+        self.config = ShopifyConfig.objects.create(
+            shop_url='test.myshopify.com', access_token='token', last_sync_at=self.last_sync_at
+        )
+        Product.objects.create(sku='SKU-A', name='A', physical_stock=10, available_stock=10)
+
+    def page(self, orders, next_url=None):
+        response = fake_response(data={'orders': orders})
+        response.links = {'next': {'url': next_url}} if next_url else {}
+        return response
+
+    def test_every_linked_page_is_ingested(self):
+        pages = [self.page([shopify_order(1), shopify_order(2)], self.next_url), self.page([shopify_order(3)])]
+        updated_at_min = (self.last_sync_at - timedelta(minutes=1)).isoformat()
+
+        with mock.patch.object(ShopifyClient, 'get', autospec=True, side_effect=pages) as get:
+            stats = ShopifyOrderService.sync_store_orders(self.config)
+
+        self.assertEqual(stats, {'created': 3, 'updated': 0, 'skipped': 0})
+        self.assertEqual(set(Order.objects.values_list('reference', flat=True)), {'1', '2', '3'})
+        first, second = get.call_args_list
+        self.assertEqual(first.args[1], 'orders.json')
+        self.assertEqual(first.kwargs['params']['updated_at_min'], updated_at_min)
+        # The cursor URL carries its own filters
+        self.assertEqual((second.args[1], second.kwargs['params']), (self.next_url, None))
+        self.config.refresh_from_db()
+        self.assertGreater(self.config.last_sync_at, self.last_sync_at)
+
+    def test_failed_page_keeps_the_sync_cursor(self):
+        pages = [self.page([shopify_order(1)], self.next_url), requests.HTTPError('502 error')]
+
+        with mock.patch.object(ShopifyClient, 'get', autospec=True, side_effect=pages):
+            stats = ShopifyOrderService.sync_store_orders(self.config)
+
+        self.assertEqual(stats, {'created': 1, 'updated': 0, 'skipped': 0, 'error': '502 error'})
+        # The first page stays committed, the next run fetches it again from the old cursor
+        self.assertTrue(Order.objects.filter(reference='1').exists())
+        self.config.refresh_from_db()
+        self.assertEqual(self.config.last_sync_at, self.last_sync_at)
+
+
+class ShopifyProductLinkTest(TestCase):
+
+    def setUp(self):
+        self.config = ShopifyConfig.objects.create(shop_url='test.myshopify.com', access_token='token')
+        self.products = [
+            Product.objects.create(sku=sku, name=sku, physical_stock=1, available_stock=1)
+            for sku in ['SKU-A', 'SKU-B', 'SKU-C']
+        ]
+        self.redis = FakeRedis()
+        patcher = mock.patch('business.shopify_products.get_redis_client', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def variants_response(self, *skus):
+        edges = [
+            {'node': {'sku': sku, 'inventoryItem': {'id': f'gid://shopify/InventoryItem/{index}'}}}
+            for index, sku in enumerate(skus, start=1)
+        ]
+        return {'data': {'productVariants': {'edges': edges}}}
+
+    def test_skus_are_resolved_in_one_query(self):
+        with mock.patch.object(
+            ShopifyClient, 'graphql', autospec=True, return_value=self.variants_response('SKU-A', 'SKU-B')
+        ) as graphql:
+            links = ShopifyProductService.resolve_product_links(self.config, self.products)
+
+        graphql.assert_called_once()
+        variables = graphql.call_args.args[2]
+        self.assertEqual(variables['sku_filter'], 'sku:"SKU-A" OR sku:"SKU-B" OR sku:"SKU-C"')
+        self.assertEqual(
+            {links[product.pk].inventory_item_id for product in self.products[:2]}, {1, 2}
+        )
+        self.assertNotIn(self.products[2].pk, links)
+        self.assertEqual(ShopifyProduct.objects.filter(config=self.config).count(), 2)
+
+    def test_missing_sku_is_cached_with_a_ttl(self):
+        key = ShopifyProductService._missing_sku_key(self.config, 'SKU-C')
+
+        with mock.patch.object(ShopifyClient, 'graphql', return_value=self.variants_response('SKU-A', 'SKU-B')):
+            ShopifyProductService.resolve_product_links(self.config, self.products)
+
+        self.assertEqual(self.redis.get(key), b'1')
+        self.assertEqual(self.redis.ttls[key], settings.SHOPIFY_MISSING_SKU_TTL)
+
+    def test_cached_missing_sku_is_not_looked_up_again(self):
+        self.redis.set(ShopifyProductService._missing_sku_key(self.config, 'SKU-C'), 1)
+        ShopifyProduct.objects.create(config=self.config, product=self.products[0], inventory_item_id=1)
+
+        with mock.patch.object(ShopifyClient, 'graphql', autospec=True, return_value=self.variants_response('SKU-B')) as graphql:
+            links = ShopifyProductService.resolve_product_links(self.config, self.products)
+
+        # Only SKU-B is neither linked nor known to be missing
+        self.assertEqual(graphql.call_args.args[2]['sku_filter'], 'sku:"SKU-B"')
+        self.assertEqual(set(links), {self.products[0].pk, self.products[1].pk})
+
+        with mock.patch.object(ShopifyClient, 'graphql') as graphql:
+            ShopifyProductService.resolve_product_links(self.config, self.products)
+
+        graphql.assert_not_called()
+
+    def test_failed_lookup_is_not_cached_as_missing(self):
+        with mock.patch.object(ShopifyClient, 'graphql', side_effect=requests.HTTPError('502 error')):
+            links = ShopifyProductService.resolve_product_links(self.config, self.products)
+
+        self.assertEqual(links, {})
+        self.assertEqual(self.redis.data, {})
+
+
+@override_settings(MICRO_OMS_API_KEY='test-key')
+class ExportTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient(headers={'X-API-KEY': 'test-key'})
+        address = Address.objects.create(**ADDRESS)
+        self.product_a = Product.objects.create(sku='SKU-A', name='A', physical_stock=10, available_stock=10)
+        self.product_b = Product.objects.create(sku='SKU-B', name='B', physical_stock=5, available_stock=5)
+        for i, status in enumerate([Order.Status.WAITING_PAYMENT, Order.Status.SHIPPED]):
+            order = Order.objects.create(
+                reference=f'REF-{i}', shipping_address=address, customer_email='jane@example.com', status=status
+            )
+            OrderLine.objects.create(order=order, product=self.product_a, quantity=1, unit_price=Decimal('2.50'))
+            OrderLine.objects.create(order=order, product=self.product_b, quantity=2, unit_price=Decimal('1.00'))
+
+    def read(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_orders_ndjson_has_one_line_per_order(self):
+        response = self.client.get('/api/orders/export/')
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="orders.ndjson"')
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual([row['reference'] for row in rows], ['REF-1', 'REF-0'])
+        self.assertEqual(
+            rows[0]['order_lines'],
+            [{'sku': 'SKU-A', 'quantity': 1, 'unit_price': '2.50'}, {'sku': 'SKU-B', 'quantity': 2, 'unit_price': '1.00'}],
+        )
+
+    def test_orders_csv_has_a_header_and_one_row_per_line(self):
+        response = self.client.get('/api/orders/export/?export_format=csv')
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = self.read(response).splitlines()
+        self.assertEqual(lines[0], (
+            'id,reference,status,customer_email,created_at,updated_at,'
+            'address_name,address_street,address_postal_code,address_country_code,'
+            'line_sku,line_quantity,line_unit_price'
+        ))
+        self.assertEqual(len(lines), 5)
+        self.assertEqual([line.split(',')[-3] for line in lines[1:]], ['SKU-A', 'SKU-B', 'SKU-A', 'SKU-B'])
+
+    def test_orders_export_applies_the_filters(self):
+        response = self.client.get('/api/orders/export/?status=SHIPPED')
+
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual([row['reference'] for row in rows], ['REF-1'])
+
+    def test_products_csv(self):
+        response = self.client.get('/api/products/export/?export_format=csv')
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = self.read(response).splitlines()
+        self.assertEqual(lines[0], 'id,sku,name,physical_stock,available_stock,reserved_stock,pictureUrl')
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['SKU-A', 'SKU-B'])
+
+    def test_unknown_export_format_is_rejected(self):
+        response = self.client.get('/api/orders/export/?export_format=xml')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_data_command_writes_the_filtered_orders(self):
+        out = StringIO()
+
+        call_command('export_data', 'orders', status='WAITING_PAYMENT', stdout=out)
+
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row['reference'] for row in rows], ['REF-0'])
+
+    def test_export_data_command_writes_a_csv_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'products.csv')
+            call_command('export_data', 'products', export_format='csv', output=path)
+            with open(path, newline='') as export_file:
+                lines = export_file.read().splitlines()
+
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('id,sku,'))
+
+
+class ShopSyncTaskTest(TestCase):
+
+    def setUp(self):
+        self.configs = [
+            ShopifyConfig.objects.create(shop_url=f'shop-{i}.myshopify.com', access_token='token')
+            for i in range(2)
+        ]
+        self.redis = FakeRedis()
+        for target, value in [
+            ('business.shopify_orders.get_redis_client', mock.Mock(return_value=self.redis)),
+            ('business.shopify_orders.ShopifyOrderService.sync_store_orders',
+             mock.Mock(return_value={'created': 1, 'updated': 0})),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Run the chord and its callback in process
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+
+    def test_every_active_shop_is_synced_and_collected(self):
+        with self.assertLogs('business.tasks', 'INFO') as logs:
+            self.assertEqual(sync_shopify_orders_task(), 'Dispatched 2 shop syncs.')
+
+        self.assertEqual(ShopifyOrderService.sync_store_orders.call_count, 2)
+        self.assertIn(
+            "Shopify Order Sync Finished: {'shop-0.myshopify.com': {'created': 1, 'updated': 0}, "
+            "'shop-1.myshopify.com': {'created': 1, 'updated': 0}}",
+            logs.output[-1],
+        )
+
+    def test_shop_with_a_held_lock_is_skipped(self):
+        locked = self.configs[1]
+        self.redis.set(f'shopify:order_sync_lock:{locked.pk}', 'other-worker')
+
+        results = [sync_shop_orders_task.delay(config.pk).get() for config in self.configs]
+
+        self.assertEqual(results[1], {
+            'shop': locked.shop_url, 'stats': {'created': 0, 'updated': 0, 'error': 'Sync already running'}
+        })
+        ShopifyOrderService.sync_store_orders.assert_called_once_with(self.configs[0])
+        self.assertEqual(self.redis.get(f'shopify:order_sync_lock:{locked.pk}'), b'other-worker')
+        self.assertNotIn(f'shopify:order_sync_lock:{self.configs[0].pk}', self.redis.data)
+
+    def test_inactive_shop_is_left_out_of_the_results(self):
+        self.configs[1].active = False
+        self.configs[1].save()
+
+        results = [sync_shop_orders_task(config.pk) for config in self.configs]
+
+        self.assertEqual(collect_shop_sync_results(results), {'shop-0.myshopify.com': {'created': 1, 'updated': 0}})
+
+
+@override_settings(MICRO_OMS_API_KEY='test-key')
+class OrderActionLookupTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient(headers={'X-API-KEY': 'test-key'})
+        self.order = Order.objects.create(
+            reference='REF-1', shipping_address=Address.objects.create(**ADDRESS), customer_email='jane@example.com'
+        )
+
+    def test_available_actions_loads_only_the_order_row(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/orders/{self.order.pk}/available_actions/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), OrderService.get_available_actions(self.order.status))
+
+    def test_actions_on_unknown_orders_return_404(self):
+        for url in ['/api/orders/999/pay/', '/api/orders/999/cancel/', '/api/orders/abc/ship/']:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.post(url).status_code, 404)
+
+
+class AsyncTransportEnabledTest(TestCase):
+
+    @override_settings(SHOPIFY_TRANSPORT='threads')
+    def test_threads_setting_keeps_the_thread_pool(self):
+        self.assertFalse(async_transport_enabled())
+
+    @unittest.skipUnless(httpx, 'httpx is not installed')
+    @override_settings(SHOPIFY_TRANSPORT='async')
+    def test_async_setting_enables_the_event_loop_transport(self):
+        self.assertTrue(async_transport_enabled())
+
+    @override_settings(SHOPIFY_TRANSPORT='async')
+    def test_missing_httpx_falls_back_to_threads(self):
+        with mock.patch('business.shopify_async.httpx', None), self.assertLogs('business.shopify_async', 'WARNING'):
+            self.assertFalse(async_transport_enabled())
+
+    @unittest.skipUnless(httpx, 'httpx is not installed')
+    @override_settings(SHOPIFY_TRANSPORT='async')
+    def test_running_event_loop_falls_back_to_threads(self):
+        async def check():
+            return async_transport_enabled()
+
+        self.assertFalse(asyncio.run(check()))
+
+
+@unittest.skipUnless(httpx, 'httpx is not installed')
+@override_settings(SHOPIFY_MAX_RETRIES=2)
+class AsyncShopifyTransportTest(TestCase):
+
+    def setUp(self):
+        self.configs = [
+            ShopifyConfig.objects.create(shop_url=f'shop-{i}.myshopify.com', access_token=f'token-{i}')
+            for i in range(2)
+        ]
+        patcher = mock.patch.dict(ShopifyClient._clients, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.in_flight = {}
+        self.max_in_flight = {}
+        self.requests = []
+
+    def run_calls(self, handler, calls, **limits):
+        async def track(request):
+            shop = request.url.host
+            self.requests.append(request)
+            self.in_flight[shop] = self.in_flight.get(shop, 0) + 1
+            self.max_in_flight[shop] = max(self.max_in_flight.get(shop, 0), self.in_flight[shop])
+            await asyncio.sleep(0.001)
+            self.in_flight[shop] -= 1
+            return handler(request)
+
+        real_client = httpx.AsyncClient
+        with mock.patch(
+            'business.shopify_async.httpx.AsyncClient',
+            lambda **kwargs: real_client(transport=httpx.MockTransport(track), **kwargs),
+        ):
+            return AsyncShopifyTransport(**limits).run_graphql(calls)
+
+    def test_calls_run_concurrently_within_the_per_shop_limit(self):
+        calls = [(config, 'query { shop { id } }', {'n': n}) for config in self.configs for n in range(6)]
+
+        results = self.run_calls(
+            lambda request: httpx.Response(200, json={'data': json.loads(request.content)['variables']}),
+            calls, per_shop_concurrency=2,
+        )
+
+        # Results come back in the order of the calls
+        self.assertEqual(results, [{'data': {'n': n}} for _ in self.configs for n in range(6)])
+        self.assertEqual(self.max_in_flight, {config.shop_url: 2 for config in self.configs})
+        self.assertEqual(
+            {request.headers['X-Shopify-Access-Token'] for request in self.requests}, {'token-0', 'token-1'}
+        )
+
+    def test_failed_call_is_returned_without_failing_the_others(self):
+        def handler(request):
+            if request.url.host == 'shop-1.myshopify.com':
+                return httpx.Response(500)
+            return httpx.Response(200, json={'data': {}})
+
+        results = self.run_calls(handler, [(config, 'query { shop { id } }', {}) for config in self.configs])
+
+        self.assertEqual(results[0], {'data': {}})
+        self.assertIsInstance(results[1], httpx.HTTPStatusError)
+
+    def test_throttled_call_is_retried(self):
+        responses = iter([
+            httpx.Response(429, headers={'Retry-After': '0'}),
+            httpx.Response(200, json={'errors': [{'extensions': {'code': 'THROTTLED'}}]}),
+            httpx.Response(200, json={'data': {'ok': True}}),
+        ])
+
+        with mock.patch.object(ShopifyClient, 'backoff_delay', return_value=0) as backoff_delay:
+            results = self.run_calls(lambda request: next(responses), [(self.configs[0], 'query { shop { id } }', {})])
+
+        self.assertEqual(results, [{'data': {'ok': True}}])
+        self.assertEqual(backoff_delay.call_count, 2)
+
+    def test_retries_give_up_and_surface_the_error(self):
+        with mock.patch.object(ShopifyClient, 'backoff_delay', return_value=0):
+            results = self.run_calls(lambda request: httpx.Response(429), [(self.configs[0], 'query { shop { id } }', {})])
+
+        self.assertEqual(len(self.requests), 3)
+        self.assertIsInstance(results[0], httpx.HTTPStatusError)
+
+
+class ShopifyClientStreamTest(TestCase):
+
+    def setUp(self):
+        self.config = ShopifyConfig.objects.create(shop_url='test.myshopify.com', access_token='token')
+        patcher = mock.patch.dict(ShopifyClient._clients, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client_ = ShopifyClient.for_config(self.config)
+        self.client_.session = mock.Mock()
+
+    def stream_response(self, status_code, lines=()):
+        response = mock.MagicMock(status_code=status_code)
+        response.__enter__.return_value = response
+        response.iter_lines.return_value = iter(lines)
+        if status_code >= 400:
+            response.raise_for_status.side_effect = requests.HTTPError(f"{status_code} error")
+        return response
+
+    def test_download_is_streamed_without_the_shop_credentials(self):
+        self.client_.session.get.return_value = self.stream_response(200)
+
+        self.client_.stream('https://storage.example.com/bulk.jsonl')
+
+        args, kwargs = self.client_.session.get.call_args
+        self.assertEqual(args, ('https://storage.example.com/bulk.jsonl',))
+        self.assertTrue(kwargs['stream'])
+        self.assertNotIn('headers', kwargs)
+
+    def test_bulk_result_is_ingested_from_the_stream(self):
+        Product.objects.create(sku='SKU-A', name='A', physical_stock=10, available_stock=10)
+        lines = [json.dumps(row) for row in bulk_order_rows(1, [('SKU-A', 2, '2.50')])] + ['']
+        self.client_.session.get.return_value = self.stream_response(200, lines)
+
+        with mock.patch.object(ShopifyOrderService, '_run_bulk_orders_query', return_value='https://storage.example.com/bulk.jsonl'):
+            stats = ShopifyOrderService.backfill_store_orders(self.config)
+
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(list(Order.objects.get(reference='1').order_lines.values_list('quantity', flat=True)), [2])
+
+    def test_download_error_is_surfaced(self):
+        self.client_.session.get.return_value = self.stream_response(403)
+
+        with self.assertRaises(requests.HTTPError):
+            self.client_.stream('https://storage.example.com/bulk.jsonl')
+
+        with mock.patch.object(ShopifyOrderService, '_run_bulk_orders_query', return_value='https://storage.example.com/bulk.jsonl'):
+            stats = ShopifyOrderService.backfill_store_orders(self.config)
+
+        self.assertEqual(stats, {'created': 0, 'updated': 0, 'error': '403 error'})
+        self.config.refresh_from_db()
+        self.assertIsNone(self.config.last_sync_at)
@@ -1,7 +1,8 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
 from .views import ProductViewSet, OrderViewSet
 from .shopify_oauth import ShopifyInstallView, ShopifyCallbackView
+from .shopify_webhooks import ShopifyOrderWebhookView
 
 router = DefaultRouter()
 router.register(r'products', ProductViewSet)
@@ -11,4 +12,9 @@ urlpatterns = [
     path('', include(router.urls)),
     path('shopify/install/', ShopifyInstallView.as_view(), name='shopify-install'),
     path('shopify/callback/', ShopifyCallbackView.as_view(), name='shopify-callback'),
+    re_path(
+        r'^shopify/webhooks/orders/(?P<topic>create|updated|cancelled)/$',
+        ShopifyOrderWebhookView.as_view(),
+        name='shopify-order-webhook'
+    ),
 ]
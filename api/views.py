@@ -1,15 +1,51 @@
+from decimal import Decimal
+from django.db.models import DecimalField, F, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
-from domain.models import Product, Order
-from .serializers import ProductSerializer, OrderSerializer
+from domain.models import Product, Order, OrderLine
+from .serializers import (
+    ProductSerializer, ProductUpsertSerializer, BulkProductUpsertSerializer,
+    OrderSerializer, BulkOrderActionSerializer, BulkShipSerializer
+)
 from business.orders import OrderService
 from business.products import ProductService
+from business.exports import ExportService
 from .filters import OrderFilter
+from .pagination import OrderCursorPagination, ProductCursorPagination
 
-class ProductViewSet(viewsets.ModelViewSet):
+class StreamingExportMixin:
+    """
+    GET export/?export_format=ndjson|csv streams the rows returned by the
+    viewset's stream_export(export_format).
+    """
+    export_name = None
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # 'format' is taken by DRF content negotiation
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in ExportService.FORMATS:
+            return Response(
+                {'error': f"export_format must be one of {', '.join(ExportService.FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        response = StreamingHttpResponse(
+            self.stream_export(export_format), content_type=ExportService.FORMATS[export_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{self.export_name}.{export_format}"'
+        return response
+
+
+class ProductViewSet(StreamingExportMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
+    export_name = 'products'
 
     def perform_create(self, serializer):
         instance = Product(**serializer.validated_data)
@@ -21,11 +57,86 @@ class ProductViewSet(viewsets.ModelViewSet):
             setattr(instance, attr, value)
         ProductService.save_product(instance)
 
+    @action(detail=False, methods=['post'], url_path='bulk-upsert')
+    def bulk_upsert(self, request):
+        """
+        Creates or updates products keyed by sku. Valid rows are written in one
+        transaction, invalid ones are reported without failing the batch.
+        """
+        serializer = BulkProductUpsertSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        rows = serializer.validated_data['products']
+
+        # Same sku as the serializer would validate it, so lookups and duplicates see the stored value
+        skus = [self._normalize_sku(row.get('sku')) for row in rows]
+        sku_counts = {}
+        for sku in skus:
+            if sku:
+                sku_counts[sku] = sku_counts.get(sku, 0) + 1
+        existing = {product.sku: product for product in Product.objects.filter(sku__in=sku_counts.keys())}
+
+        results = []
+        valid_rows = []
+        for index, (row, sku) in enumerate(zip(rows, skus)):
+            if sku and sku_counts[sku] > 1:
+                results.append({'index': index, 'sku': sku, 'errors': {'sku': ["Duplicate sku in the payload"]}})
+                continue
+
+            instance = existing.get(sku)
+            data = {**row, 'sku': sku} if sku is not None else row
+            row_serializer = ProductUpsertSerializer(instance, data=data, partial=instance is not None)
+            if not row_serializer.is_valid():
+                results.append({'index': index, 'sku': sku, 'errors': row_serializer.errors})
+                continue
+            results.append({'index': index, 'sku': row_serializer.validated_data['sku']})
+            valid_rows.append(row_serializer.validated_data)
+
+        created, updated = ProductService.bulk_upsert_products(valid_rows) if valid_rows else ([], [])
+        created_skus = {product.sku for product in created}
+        updated_skus = {product.sku for product in updated}
+        for result in results:
+            if 'errors' in result:
+                continue
+            if result['sku'] in created_skus:
+                result['status'] = 'created'
+            elif result['sku'] in updated_skus:
+                result['status'] = 'updated'
+            else:
+                result['status'] = 'unchanged'
+        return Response({'results': results})
+
+    @staticmethod
+    def _normalize_sku(sku):
+        if isinstance(sku, bool) or not isinstance(sku, (str, int)):
+            return None
+        return str(sku).strip()
 
-class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all().order_by('-created_at')
+    def stream_export(self, export_format):
+        return ExportService.stream_products(ExportService.products_queryset(), export_format)
+
+
+# Sum of the order lines computed by the database, one subquery per order row
+ORDER_TOTAL_PRICE = Coalesce(
+    Subquery(
+        OrderLine.objects.filter(order=OuterRef('pk')).values('order').annotate(
+            total=Sum(F('unit_price') * F('quantity'))
+        ).values('total'),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    ),
+    Value(Decimal('0.00')),
+    output_field=DecimalField(max_digits=12, decimal_places=2)
+)
+
+
+class OrderViewSet(StreamingExportMixin, viewsets.ModelViewSet):
+    # Query count does not depend on the number of orders or lines on the page
+    queryset = Order.objects.select_related('shipping_address').prefetch_related(
+        Prefetch('order_lines', queryset=OrderLine.objects.select_related('product'))
+    ).annotate(total_price=ORDER_TOTAL_PRICE).order_by('-created_at', '-id')
     serializer_class = OrderSerializer
     filterset_class = OrderFilter
+    pagination_class = OrderCursorPagination
+    export_name = 'orders'
 
     def perform_create(self, serializer):
         data = serializer.validated_data
@@ -66,11 +177,41 @@ class OrderViewSet(viewsets.ModelViewSet):
         except ValueError as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'], url_path='bulk-pay')
+    def bulk_pay(self, request):
+        serializer = BulkOrderActionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = OrderService.bulk_confirm_payment(serializer.validated_data['order_ids'])
+        return Response({'results': results})
+
+    @action(detail=False, methods=['post'], url_path='bulk-ship')
+    def bulk_ship(self, request):
+        serializer = BulkShipSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['orders']
+        results = OrderService.bulk_ship_orders(
+            [item['id'] for item in items],
+            {item['id']: item['tracking'] for item in items if item.get('tracking')}
+        )
+        return Response({'results': results})
+
+    @action(detail=False, methods=['post'], url_path='bulk-cancel')
+    def bulk_cancel(self, request):
+        serializer = BulkOrderActionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = OrderService.bulk_cancel_orders(serializer.validated_data['order_ids'])
+        return Response({'results': results})
+
+    def stream_export(self, export_format):
+        queryset = self.filter_queryset(ExportService.orders_queryset())
+        return ExportService.stream_orders(queryset, export_format)
+
     @action(detail=True, methods=['get'])
     def available_actions(self, request, pk=None):
-        order = self.get_object()
+        order = self._check_object()
         actions = OrderService.get_available_actions(order.status)
         return Response(actions)
         
     def _check_object(self):
-        self.get_object()
\ No newline at end of file
+        # 404 for unknown orders without loading the annotated list queryset
+        return get_object_or_404(Order.objects.only('status'), pk=self.kwargs['pk'])
\ No newline at end of file
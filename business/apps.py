@@ -0,0 +1,7 @@
+from django.apps import AppConfig
+
+class BusinessConfig(AppConfig):
+    name = 'business'
+
+    def ready(self):
+        from business import signals  # noqa: F401
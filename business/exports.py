@@ -0,0 +1,88 @@
+import csv
+import json
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from domain.models import Order, OrderLine, Product
+
+class ExportService:
+    """
+    Streams orders and products as NDJSON or CSV. Rows are read with iterator(chunk_size)
+    and encoded one at a time, memory stays flat whatever the size of the export.
+    """
+    FORMATS = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+
+    ORDER_FIELDS = ['id', 'reference', 'status', 'customer_email', 'created_at', 'updated_at']
+    ADDRESS_FIELDS = ['name', 'street', 'postal_code', 'country_code']
+    LINE_FIELDS = ['sku', 'quantity', 'unit_price']
+    PRODUCT_FIELDS = ['id', 'sku', 'name', 'physical_stock', 'available_stock', 'reserved_stock', 'pictureUrl']
+
+    @classmethod
+    def orders_queryset(cls):
+        return Order.objects.select_related('shipping_address').prefetch_related(
+            Prefetch('order_lines', queryset=OrderLine.objects.select_related('product'))
+        ).order_by('-created_at', '-id')
+
+    @classmethod
+    def products_queryset(cls):
+        return Product.objects.order_by('id')
+
+    @classmethod
+    def stream_orders(cls, queryset, export_format, chunk_size=None):
+        rows = cls._iter_order_rows(queryset, chunk_size)
+        if export_format == 'csv':
+            # One CSV row per order line, the order columns are repeated
+            header = cls.ORDER_FIELDS + [f'address_{f}' for f in cls.ADDRESS_FIELDS] + [f'line_{f}' for f in cls.LINE_FIELDS]
+            return cls._iter_csv(header, (flat for row in rows for flat in cls._flatten_order(row)))
+        return cls._iter_ndjson(rows)
+
+    @classmethod
+    def stream_products(cls, queryset, export_format, chunk_size=None):
+        chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+        rows = queryset.values(*cls.PRODUCT_FIELDS).iterator(chunk_size=chunk_size)
+        if export_format == 'csv':
+            return cls._iter_csv(cls.PRODUCT_FIELDS, ([row[f] for f in cls.PRODUCT_FIELDS] for row in rows))
+        return cls._iter_ndjson(rows)
+
+    @classmethod
+    def _iter_order_rows(cls, queryset, chunk_size):
+        # The prefetch runs once per chunk
+        for order in queryset.iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE):
+            row = {field: getattr(order, field) for field in cls.ORDER_FIELDS}
+            row['shipping_address'] = {field: getattr(order.shipping_address, field) for field in cls.ADDRESS_FIELDS}
+            row['order_lines'] = [
+                {'sku': line.product.sku, 'quantity': line.quantity, 'unit_price': line.unit_price}
+                for line in order.order_lines.all()
+            ]
+            yield row
+
+    @classmethod
+    def _flatten_order(cls, row):
+        head = [row[f] for f in cls.ORDER_FIELDS] + [row['shipping_address'][f] for f in cls.ADDRESS_FIELDS]
+        if not row['order_lines']:
+            yield head + [''] * len(cls.LINE_FIELDS)
+        for line in row['order_lines']:
+            yield head + [line[f] for f in cls.LINE_FIELDS]
+
+    @classmethod
+    def _iter_ndjson(cls, rows):
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+    @classmethod
+    def _iter_csv(cls, header, rows):
+        writer = csv.writer(_Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+
+class _Echo:
+    """
+    File-like object handing the line back to the caller instead of buffering it.
+    """
+    def write(self, value):
+        return value
@@ -0,0 +1,127 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from domain.models import FulfillmentOutbox, ShopifyOrder
+from business.shopify_orders import ShopifyOrderService
+import logging
+
+class FulfillmentService:
+    """
+    Transactional outbox for Shopify fulfillments: rows are written in the same
+    transaction as the SHIPPED status and delivered asynchronously with retries.
+    """
+    logger = logging.getLogger(__name__)
+
+    TRACKING_FIELDS = ['number', 'carrier', 'url']
+
+    @classmethod
+    def enqueue(cls, order, tracking=None):
+        """
+        Must run inside the transaction shipping the order. Orders not linked to a
+        Shopify order have nothing to fulfill.
+        """
+        if not ShopifyOrder.objects.filter(order=order).exists():
+            return None
+
+        entry = FulfillmentOutbox.objects.create(order=order, tracking=cls._normalize_tracking(tracking))
+        transaction.on_commit(lambda: cls._schedule(entry.pk))
+        return entry
+
+    @classmethod
+    def enqueue_many(cls, orders, tracking_by_order=None):
+        """
+        Batch variant of enqueue: one lookup for the Shopify links, one INSERT, and a
+        single outbox sweep scheduled on commit instead of one task per order.
+        tracking_by_order maps order ids to their tracking info.
+        """
+        tracking_by_order = tracking_by_order or {}
+        linked = set(
+            ShopifyOrder.objects.filter(order__in=orders).values_list('order_id', flat=True)
+        )
+        entries = FulfillmentOutbox.objects.bulk_create([
+            FulfillmentOutbox(order=order, tracking=cls._normalize_tracking(tracking_by_order.get(order.pk)))
+            for order in orders if order.pk in linked
+        ])
+        if entries:
+            transaction.on_commit(cls._schedule_sweep)
+        return entries
+
+    @classmethod
+    def _normalize_tracking(cls, tracking):
+        tracking = tracking or {}
+        return {key: tracking.get(key) for key in cls.TRACKING_FIELDS if tracking.get(key)}
+
+    @classmethod
+    def _schedule(cls, entry_id):
+        from business.tasks import dispatch_fulfillment_task
+        try:
+            dispatch_fulfillment_task.delay(entry_id)
+        except Exception as e:
+            # The periodic sweep picks the entry up anyway
+            cls.logger.error(f"Could not schedule fulfillment {entry_id}: {e}")
+
+    @classmethod
+    def _schedule_sweep(cls):
+        from business.tasks import dispatch_fulfillment_outbox_task
+        try:
+            dispatch_fulfillment_outbox_task.delay()
+        except Exception as e:
+            # The periodic sweep runs anyway
+            cls.logger.error(f"Could not schedule the fulfillment outbox sweep: {e}")
+
+    @classmethod
+    def dispatch(cls, entry_id):
+        """
+        Delivers one pending entry. The row stays locked during the Shopify call so
+        concurrent dispatchers never deliver it twice.
+        """
+        with transaction.atomic():
+            entry = FulfillmentOutbox.objects.select_for_update(skip_locked=True).select_related('order').filter(
+                pk=entry_id, status=FulfillmentOutbox.Status.PENDING
+            ).first()
+            if not entry:
+                return None
+
+            try:
+                delivered = ShopifyOrderService.fulfill_order(entry.order, entry.tracking)
+                error = '' if delivered else 'Shopify did not accept the fulfillment, see the shopify logs'
+            except Exception as e:
+                delivered = False
+                error = str(e)
+
+            entry.attempts += 1
+            entry.last_error = error
+            if delivered:
+                entry.status = FulfillmentOutbox.Status.SENT
+            elif entry.attempts >= settings.FULFILLMENT_OUTBOX_MAX_ATTEMPTS:
+                entry.status = FulfillmentOutbox.Status.DEAD
+                cls.logger.error(f"Fulfillment of order {entry.order.reference} dead after {entry.attempts} attempts: {error}")
+            else:
+                delay = min(
+                    settings.FULFILLMENT_OUTBOX_MAX_DELAY,
+                    settings.FULFILLMENT_OUTBOX_BASE_DELAY * 2 ** (entry.attempts - 1)
+                )
+                entry.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+            entry.save()
+            return entry.status
+
+    @classmethod
+    def dispatch_due(cls, limit=None):
+        """
+        Delivers the pending entries whose next attempt is due, returns {status: count}.
+        """
+        limit = limit or settings.FULFILLMENT_OUTBOX_BATCH_SIZE
+        entry_ids = list(
+            FulfillmentOutbox.objects.filter(
+                status=FulfillmentOutbox.Status.PENDING,
+                next_attempt_at__lte=timezone.now()
+            ).order_by('next_attempt_at').values_list('pk', flat=True)[:limit]
+        )
+
+        stats = {}
+        for entry_id in entry_ids:
+            status = cls.dispatch(entry_id)
+            if status:
+                stats[str(status)] = stats.get(str(status), 0) + 1
+        return stats
@@ -1,6 +1,8 @@
+from decimal import Decimal
 from domain.models import Order, OrderLine, Address
 from business.products import ProductService
 from django.db import transaction
+from django.utils import timezone
 
 class OrderRepository:
 
@@ -14,6 +16,7 @@ class OrderRepository:
         return cls._create_order(reference, shipping_address_data, order_lines_data, customer_email, final_status)
     
     @classmethod
+    @transaction.atomic
     def _create_order(cls, reference, shipping_address_data, order_lines_data, customer_email, status):
         address = Address.objects.create(**shipping_address_data)
         order = Order.objects.create(
@@ -22,29 +25,224 @@ class OrderRepository:
             customer_email=customer_email,
             status=status
         )
-        cls._create_lines(order, order_lines_data)
-        ProductService.mark_products_dirty(order)
+        lines = cls._create_lines(order, order_lines_data)
+        cls._apply_reserved_deltas(
+            cls._reserved_deltas(None, [], status, [(line.product_id, line.quantity) for line in lines])
+        )
         return order
 
     @classmethod
+    @transaction.atomic
     def _update_order(cls, order, shipping_address_data, order_lines_data, customer_email, status):
 
         address = order.shipping_address
-        for key, value in shipping_address_data.items():
-            setattr(address, key, value)
-        address.save()
+        if cls._set_changed(address, shipping_address_data):
+            address.save()
+
+        old_status = order.status
+        old_lines = list(order.order_lines.all())
+        old_quantities = [(line.product_id, line.quantity) for line in old_lines]
 
         order.customer_email = customer_email
         if status:
             order.status = status
         order.save()
 
-        order.order_lines.all().delete()
-        cls._create_lines(order, order_lines_data)
-        ProductService.mark_products_dirty(order)
+        to_update, to_create, to_delete = cls._diff_lines(order, old_lines, order_lines_data)
+        if to_update:
+            OrderLine.objects.bulk_update(to_update, ['quantity', 'unit_price'])
+        if to_delete:
+            OrderLine.objects.filter(pk__in=to_delete).delete()
+        if to_create:
+            OrderLine.objects.bulk_create(to_create)
+
+        new_lines = [line for line in old_lines if line.pk not in to_delete] + to_create
+        cls._apply_reserved_deltas(cls._reserved_deltas(
+            old_status, old_quantities, order.status,
+            [(line.product_id, line.quantity) for line in new_lines]
+        ))
         return order
     
     @classmethod
     def _create_lines(cls, order, order_lines_data):
+        return [OrderLine.objects.create(order=order, **line_data) for line_data in order_lines_data]
+
+    @classmethod
+    def _set_changed(cls, instance, values):
+        """
+        Assigns values on the instance, returns True if any of them changed.
+        """
+        changed = False
+        for key, value in values.items():
+            if getattr(instance, key) != value:
+                setattr(instance, key, value)
+                changed = True
+        return changed
+
+    @classmethod
+    def _diff_lines(cls, order, old_lines, order_lines_data):
+        """
+        Matches new line data against the existing lines of the order by product.
+        Returns (lines to update, unsaved lines to create, ids of lines to delete).
+        Existing OrderLine instances are updated in place.
+        """
+        remaining = {}
+        for line in old_lines:
+            remaining.setdefault(line.product_id, []).append(line)
+
+        to_update = []
+        to_create = []
         for line_data in order_lines_data:
-            OrderLine.objects.create(order=order, **line_data)
\ No newline at end of file
+            product = line_data['product']
+            candidates = remaining.get(product.pk)
+            if not candidates:
+                to_create.append(OrderLine(order=order, **line_data))
+                continue
+
+            line = candidates.pop(0)
+            quantity = line_data['quantity']
+            unit_price = Decimal(str(line_data['unit_price'])).quantize(Decimal('0.01'))
+            if line.quantity != quantity or line.unit_price != unit_price:
+                line.quantity = quantity
+                line.unit_price = unit_price
+                to_update.append(line)
+
+        to_delete = {line.pk for lines in remaining.values() for line in lines}
+        return to_update, to_create, to_delete
+
+    @classmethod
+    def _reserved_deltas(cls, old_status, old_lines, new_status, new_lines):
+        """
+        Reserved stock change when an order moves from (old_status, old_lines) to (new_status, new_lines).
+        old_lines must hold the quantities as they were before the change.
+        """
+        deltas = {}
+        if old_status and ProductService.is_reserving_status(old_status):
+            for product_id, quantity in old_lines:
+                deltas[product_id] = deltas.get(product_id, 0) - quantity
+        if ProductService.is_reserving_status(new_status):
+            for product_id, quantity in new_lines:
+                deltas[product_id] = deltas.get(product_id, 0) + quantity
+        return deltas
+
+    @classmethod
+    def _apply_reserved_deltas(cls, deltas):
+        # Products whose reservation did not move keep the same available stock, no need to recalculate them
+        deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+        ProductService.apply_reserved_deltas(deltas)
+        ProductService.mark_products_as_dirty(deltas.keys())
+
+    @classmethod
+    @transaction.atomic
+    def bulk_create_update_orders(cls, orders_data):
+        """
+        Creates or updates a whole batch of orders with a fixed number of queries.
+        orders_data items have the create_update_order keyword arguments.
+        Returns ({reference: order}, set of created references)
+        """
+        by_reference = {data['reference']: data for data in orders_data}
+        if not by_reference:
+            return {}, set()
+
+        existing = {
+            order.reference: order
+            for order in Order.objects.select_for_update().select_related('shipping_address').filter(
+                reference__in=by_reference.keys()
+            )
+        }
+
+        created_orders = cls._bulk_create_orders(
+            [data for reference, data in by_reference.items() if reference not in existing]
+        )
+        deltas, lines_to_create = cls._bulk_update_orders(existing, by_reference)
+
+        for order in created_orders:
+            for line_data in by_reference[order.reference]['order_lines_data']:
+                line = OrderLine(order=order, **line_data)
+                lines_to_create.append(line)
+                if ProductService.is_reserving_status(order.status):
+                    deltas[line.product_id] = deltas.get(line.product_id, 0) + line.quantity
+
+        if lines_to_create:
+            OrderLine.objects.bulk_create(lines_to_create)
+        cls._apply_reserved_deltas(deltas)
+
+        orders = {**existing, **{order.reference: order for order in created_orders}}
+        return orders, {order.reference for order in created_orders}
+
+    @classmethod
+    def _bulk_create_orders(cls, orders_data):
+        if not orders_data:
+            return []
+
+        addresses = Address.objects.bulk_create([
+            Address(**data['shipping_address_data']) for data in orders_data
+        ])
+        return Order.objects.bulk_create([
+            Order(
+                reference=data['reference'],
+                shipping_address=address,
+                customer_email=data['customer_email'],
+                status=data.get('status') or Order.Status.WAITING_PAYMENT
+            )
+            for data, address in zip(orders_data, addresses)
+        ])
+
+    @classmethod
+    def _bulk_update_orders(cls, existing, by_reference):
+        """
+        Updates addresses, orders and lines of existing orders in place, writing only what changed.
+        Returns the reserved stock deltas and the unsaved lines still to create.
+        """
+        if not existing:
+            return {}, []
+
+        old_lines_by_order = {}
+        for line in OrderLine.objects.filter(order__in=existing.values()):
+            old_lines_by_order.setdefault(line.order_id, []).append(line)
+
+        now = timezone.now()
+        deltas = {}
+        addresses = []
+        address_fields = set()
+        lines_to_update = []
+        lines_to_create = []
+        lines_to_delete = set()
+        for reference, order in existing.items():
+            data = by_reference[reference]
+
+            address = order.shipping_address
+            if cls._set_changed(address, data['shipping_address_data']):
+                addresses.append(address)
+                address_fields.update(data['shipping_address_data'].keys())
+
+            old_status = order.status
+            old_lines = old_lines_by_order.get(order.pk, [])
+            old_quantities = [(line.product_id, line.quantity) for line in old_lines]
+
+            order.customer_email = data['customer_email']
+            if data.get('status'):
+                order.status = data['status']
+            # bulk_update skips auto_now
+            order.updated_at = now
+
+            to_update, to_create, to_delete = cls._diff_lines(order, old_lines, data['order_lines_data'])
+            lines_to_update.extend(to_update)
+            lines_to_create.extend(to_create)
+            lines_to_delete.update(to_delete)
+
+            new_lines = [line for line in old_lines if line.pk not in to_delete] + to_create
+            for product_id, delta in cls._reserved_deltas(
+                old_status, old_quantities, order.status,
+                [(line.product_id, line.quantity) for line in new_lines]
+            ).items():
+                deltas[product_id] = deltas.get(product_id, 0) + delta
+
+        if addresses:
+            Address.objects.bulk_update(addresses, sorted(address_fields))
+        Order.objects.bulk_update(existing.values(), ['customer_email', 'status', 'updated_at'])
+        if lines_to_update:
+            OrderLine.objects.bulk_update(lines_to_update, ['quantity', 'unit_price'])
+        if lines_to_delete:
+            OrderLine.objects.filter(pk__in=lines_to_delete).delete()
+        return deltas, lines_to_create
@@ -1,7 +1,8 @@
 from django.db import transaction
-from domain.models import Order
+from django.utils import timezone
+from domain.models import Order, OrderLine
 from business.products import ProductService
-from business.shopify_orders import ShopifyOrderService
+from business.fulfillments import FulfillmentService
 
 class OrderService:
 
@@ -10,50 +11,136 @@ class OrderService:
     @transaction.atomic
     def confirm_payment(cls, order_id):
         order = Order.objects.select_for_update().get(pk=order_id)
-        if order.status != Order.Status.WAITING_PAYMENT:
-            raise ValueError(f"Cannot confirm payment for order in status {order.status}")
+        cls._check_can_pay(order)
+        old_status = order.status
         order.status = Order.Status.TO_BE_PREPARED
         order.save()
+        ProductService.apply_status_change(order, old_status, order.status)
         return order
 
     @classmethod
     @transaction.atomic
     def ship_order(cls, order_id, tracking_info=None):
         order = Order.objects.select_for_update().get(pk=order_id)
-        if order.status != Order.Status.TO_BE_PREPARED:
-            raise ValueError(f"Cannot ship order in status {order.status}")
+        cls._check_can_ship(order)
+        old_status = order.status
         order.status = Order.Status.SHIPPED
         order.save()
+        ProductService.apply_status_change(order, old_status, order.status)
 
-        cls._decrement_physical_stock(order.order_lines.all())
+        cls._decrement_physical_stock(order.order_lines.values_list('product_id', 'quantity'))
 
-        tracking = tracking_info or {}
-        ShopifyOrderService.fulfill_order(order, tracking)
+        FulfillmentService.enqueue(order, tracking_info)
 
         return order
     
     @classmethod
     def _decrement_physical_stock(cls, order_lines):
-        for line in order_lines:
-            quantity = line.quantity
-            product = line.product
-            ProductService.decrement_physical_stock(product, quantity)
+        ProductService.decrement_physical_stocks(ProductService.line_quantities(order_lines))
 
 
     @classmethod
     @transaction.atomic
     def cancel_order(cls, order_id):
         order = Order.objects.select_for_update().get(pk=order_id)
-        if order.status == Order.Status.SHIPPED:
-            raise ValueError("Cannot cancel an order that has already been shipped")
+        cls._check_can_cancel(order)
+        old_status = order.status
         order.status = Order.Status.CANCELED
         order.save()
+        ProductService.apply_status_change(order, old_status, order.status)
         ProductService.mark_products_dirty(order)
         return order
 
+    @classmethod
+    def _check_can_pay(cls, order):
+        if order.status != Order.Status.WAITING_PAYMENT:
+            raise ValueError(f"Cannot confirm payment for order in status {order.status}")
+
+    @classmethod
+    def _check_can_ship(cls, order):
+        if order.status != Order.Status.TO_BE_PREPARED:
+            raise ValueError(f"Cannot ship order in status {order.status}")
+
+    @classmethod
+    def _check_can_cancel(cls, order):
+        if order.status == Order.Status.SHIPPED:
+            raise ValueError("Cannot cancel an order that has already been shipped")
+
+    @classmethod
+    @transaction.atomic
+    def bulk_confirm_payment(cls, order_ids):
+        """
+        Set-based confirm_payment. Returns one result per id, see _bulk_transition.
+        """
+        results, _ = cls._bulk_transition(order_ids, cls._check_can_pay, Order.Status.TO_BE_PREPARED)
+        return results
+
+    @classmethod
+    @transaction.atomic
+    def bulk_ship_orders(cls, order_ids, tracking_by_order=None):
+        """
+        Set-based ship_order. tracking_by_order maps order ids to their tracking info.
+        """
+        results, orders = cls._bulk_transition(order_ids, cls._check_can_ship, Order.Status.SHIPPED)
+        if orders:
+            cls._decrement_physical_stock(
+                OrderLine.objects.filter(order__in=orders).values_list('product_id', 'quantity')
+            )
+            FulfillmentService.enqueue_many(orders, tracking_by_order)
+        return results
+
+    @classmethod
+    @transaction.atomic
+    def bulk_cancel_orders(cls, order_ids):
+        """
+        Set-based cancel_order.
+        """
+        results, orders = cls._bulk_transition(order_ids, cls._check_can_cancel, Order.Status.CANCELED)
+        if orders:
+            ProductService.mark_products_as_dirty(
+                OrderLine.objects.filter(order__in=orders).values_list('product_id', flat=True)
+            )
+        return results
+
+    @classmethod
+    def _bulk_transition(cls, order_ids, check, new_status):
+        """
+        Locks the orders in one query, validates each of them with check and moves the
+        valid ones to new_status with a single bulk_update and reserved stock UPDATE.
+        Returns ([{'id', 'status'} or {'id', 'error'} per id], moved orders).
+        """
+        order_ids = list(dict.fromkeys(order_ids))
+        orders = {
+            order.pk: order
+            for order in Order.objects.select_for_update().filter(pk__in=order_ids).order_by('pk')
+        }
 
+        now = timezone.now()
+        results = []
+        moved = []
+        changes = []
+        for order_id in order_ids:
+            order = orders.get(order_id)
+            if order is None:
+                results.append({'id': order_id, 'error': "Order not found"})
+                continue
+            try:
+                check(order)
+            except ValueError as e:
+                results.append({'id': order_id, 'error': str(e)})
+                continue
 
+            changes.append((order.pk, order.status, new_status))
+            order.status = new_status
+            # bulk_update skips auto_now
+            order.updated_at = now
+            moved.append(order)
+            results.append({'id': order_id, 'status': new_status})
 
+        if moved:
+            Order.objects.bulk_update(moved, ['status', 'updated_at'])
+            ProductService.apply_status_changes(changes)
+        return results, moved
 
     @classmethod
     def get_available_actions(cls, status):
@@ -1,16 +1,20 @@
 from domain.models import Order, OrderLine, Product
 from django.conf import settings
 from django.db import transaction
-from django.db.models import Sum
-import redis
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from business.redis_client import get_redis_client
 import logging
 
 class ProductService:
     logger = logging.getLogger(__name__)
 
+    NON_RESERVING_STATUSES = [Order.Status.CANCELED, Order.Status.SHIPPED, Order.Status.ERROR]
+    EDITABLE_FIELDS = ['sku', 'name', 'physical_stock', 'available_stock', 'pictureUrl']
+    DIRTY_MARK_CHUNK_SIZE = 1000
+
     @staticmethod
     def _get_redis_client():
-        return redis.Redis.from_url(settings.REDIS_URL)
+        return get_redis_client()
 
     @classmethod
     @transaction.atomic
@@ -21,15 +25,7 @@ class ProductService:
         try:
             product = Product.objects.select_for_update().get(pk=product_id)
 
-            reserved_agg = OrderLine.objects.filter(
-                product=product
-            ).exclude(
-                order__status__in=[Order.Status.CANCELED, Order.Status.SHIPPED, Order.Status.ERROR]
-            ).aggregate(total_reserved=Sum('quantity'))
-
-            reserved_quantity = reserved_agg['total_reserved'] or 0
-
-            new_available = product.physical_stock - reserved_quantity
+            new_available = product.physical_stock - product.reserved_stock
 
             if product.available_stock != new_available:
                 product.available_stock = new_available
@@ -44,31 +40,261 @@ class ProductService:
             cls.logger.error(
                 f"Error for product {product_id}: {e}")
 
+    @classmethod
+    @transaction.atomic
+    def recalculate_inventory_bulk(cls, product_ids):
+        """
+        Set-based variant of recalculate_inventory: one locking query and a
+        single bulk_update for the changed rows.
+        """
+        product_ids = sorted(set(product_ids))
+        if not product_ids:
+            return []
+
+        products = list(
+            Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk')
+        )
+        missing = set(product_ids) - {p.pk for p in products}
+        if missing:
+            cls.logger.warning(f"Products {sorted(missing)} not found")
+
+        changed = []
+        for product in products:
+            new_available = product.physical_stock - product.reserved_stock
+            if product.available_stock != new_available:
+                product.available_stock = new_available
+                changed.append(product)
+
+        if changed:
+            Product.objects.bulk_update(changed, ['available_stock'])
+
+        return products
+
+    @classmethod
+    def compute_reserved_quantities(cls, product_ids):
+        """
+        Returns {product_id: reserved quantity} for the given products,
+        computed from scratch with a single grouped aggregate over open order lines.
+        """
+        rows = OrderLine.objects.filter(
+            product_id__in=product_ids
+        ).exclude(
+            order__status__in=cls.NON_RESERVING_STATUSES
+        ).values('product_id').annotate(total_reserved=Sum('quantity'))
+
+        return {row['product_id']: row['total_reserved'] or 0 for row in rows}
+
+    @classmethod
+    def is_reserving_status(cls, status):
+        return status not in cls.NON_RESERVING_STATUSES
+
+    @classmethod
+    def line_quantities(cls, lines, sign=1):
+        """
+        Sums (product_id, quantity) pairs into a {product_id: delta} dict.
+        """
+        deltas = {}
+        for product_id, quantity in lines:
+            deltas[product_id] = deltas.get(product_id, 0) + sign * quantity
+        return deltas
+
+    @classmethod
+    def apply_reserved_deltas(cls, deltas):
+        """
+        Adds the given {product_id: delta} to Product.reserved_stock in a single UPDATE.
+        """
+        deltas = {pid: delta for pid, delta in deltas.items() if delta}
+        if not deltas:
+            return
+
+        Product.objects.filter(pk__in=deltas.keys()).update(
+            reserved_stock=F('reserved_stock') + Case(
+                *[When(pk=pid, then=Value(delta)) for pid, delta in deltas.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
+
+    @classmethod
+    def apply_status_change(cls, order, old_status, new_status):
+        """
+        Reserves or releases the order lines when the order enters or leaves a reserving status.
+        """
+        was_reserving = cls.is_reserving_status(old_status)
+        is_reserving = cls.is_reserving_status(new_status)
+        if was_reserving == is_reserving:
+            return
+
+        sign = 1 if is_reserving else -1
+        lines = order.order_lines.values_list('product_id', 'quantity')
+        cls.apply_reserved_deltas(cls.line_quantities(lines, sign))
+
+    @classmethod
+    def release_order(cls, order):
+        """
+        Releases the reservation of an order about to be deleted.
+        """
+        cls.apply_status_change(order, order.status, Order.Status.CANCELED)
+        cls.mark_products_dirty(order)
+
+    @classmethod
+    def apply_status_changes(cls, changes):
+        """
+        Set-based apply_status_change over (order_id, old_status, new_status) triples:
+        one query for the lines and a single UPDATE. Returns the applied {product_id: delta}.
+        """
+        signs = {}
+        for order_id, old_status, new_status in changes:
+            was_reserving = cls.is_reserving_status(old_status)
+            is_reserving = cls.is_reserving_status(new_status)
+            if was_reserving != is_reserving:
+                signs[order_id] = 1 if is_reserving else -1
+        if not signs:
+            return {}
+
+        deltas = {}
+        lines = OrderLine.objects.filter(order_id__in=signs.keys()).values_list('order_id', 'product_id', 'quantity')
+        for order_id, product_id, quantity in lines:
+            deltas[product_id] = deltas.get(product_id, 0) + signs[order_id] * quantity
+        deltas = {pid: delta for pid, delta in deltas.items() if delta}
+        cls.apply_reserved_deltas(deltas)
+        return deltas
+
     @classmethod
     def save_product(cls, product):
-        product.save()
+        if product.pk is None:
+            product.save()
+        else:
+            # reserved_stock is maintained by deltas, never overwrite it from a stale instance
+            product.save(update_fields=cls.EDITABLE_FIELDS)
         cls.mark_product_as_dirty(product.id)
         return product
 
+    @classmethod
+    @transaction.atomic
+    def bulk_upsert_products(cls, rows):
+        """
+        Creates or updates products keyed by sku with one locking query, one bulk_create
+        and one bulk_update, then marks the written products dirty in a single pipeline.
+        rows are validated field dicts with distinct skus, updates may be partial.
+        Returns (created products, updated products), unchanged products are left out.
+        """
+        existing = {
+            product.sku: product
+            for product in Product.objects.select_for_update().filter(sku__in=[row['sku'] for row in rows]).order_by('pk')
+        }
+
+        to_create = []
+        to_update = []
+        fields = set()
+        for row in rows:
+            product = existing.get(row['sku'])
+            if product is None:
+                product = Product(**row)
+                if 'available_stock' not in row:
+                    product.available_stock = product.physical_stock - product.reserved_stock
+                to_create.append(product)
+                continue
+
+            changed = {key for key, value in row.items() if key in cls.EDITABLE_FIELDS and getattr(product, key) != value}
+            for key in changed:
+                setattr(product, key, row[key])
+            if 'physical_stock' in changed and 'available_stock' not in row:
+                product.available_stock = product.physical_stock - product.reserved_stock
+                changed.add('available_stock')
+            if changed:
+                fields.update(changed)
+                to_update.append(product)
+
+        if to_create:
+            Product.objects.bulk_create(to_create)
+        if to_update:
+            Product.objects.bulk_update(to_update, sorted(fields))
+        cls.mark_products_as_dirty([product.pk for product in to_create + to_update])
+        return to_create, to_update
+
     @classmethod
     def mark_products_dirty(cls, order):
-        lines = order.order_lines.all()
-        for line in lines:
-            cls.mark_product_as_dirty(line.product.id)
+        cls.mark_products_as_dirty(order.order_lines.values_list('product_id', flat=True))
 
     @classmethod
     def mark_product_as_dirty(cls, product_id):
         """
         Marks a product for inventory recalculation
         """
+        cls.mark_products_as_dirty([product_id])
+
+    @classmethod
+    def mark_products_as_dirty(cls, product_ids):
+        """
+        Marks many products for inventory recalculation.
+        Inside a transaction the ids go to a single per-connection buffer, flushed in one
+        round trip on commit, so a rolled back transaction never flushes its marks by itself.
+        """
+        product_ids = {int(pid) for pid in product_ids}
+        if not product_ids:
+            return
+
+        connection = transaction.get_connection()
+        if not connection.in_atomic_block:
+            cls._flush_dirty_products(product_ids)
+            return
+
+        buffer = getattr(connection, '_inventory_dirty_buffer', None)
+        if buffer is None:
+            buffer = connection._inventory_dirty_buffer = set()
+        buffer.update(product_ids)
+        # Registered by every call so the marks of a committed block always have a live
+        # hook, the first one to run drains the buffer and the others find it empty.
+        # Marks made inside a rolled back block stay in the buffer and go out with the next
+        # commit on this connection: a spurious mark only costs an idempotent recalculation.
+        transaction.on_commit(lambda: cls._flush_dirty_buffer(connection))
+
+    @classmethod
+    def _flush_dirty_buffer(cls, connection):
+        buffer = getattr(connection, '_inventory_dirty_buffer', None)
+        if not buffer:
+            return
+        connection._inventory_dirty_buffer = set()
+        cls._flush_dirty_products(buffer)
+
+    @classmethod
+    def _flush_dirty_products(cls, product_ids):
+        """
+        Sends the dirty marks in one pipelined round trip
+        """
+        product_ids = sorted(product_ids)
+        if not product_ids:
+            return
         try:
             client = cls._get_redis_client()
-            client.sadd(settings.REDIS_INVENTORY_DIRTY_SET_KEY, product_id)
+            pipe = client.pipeline(transaction=False)
+            for i in range(0, len(product_ids), cls.DIRTY_MARK_CHUNK_SIZE):
+                pipe.sadd(settings.REDIS_INVENTORY_DIRTY_SET_KEY, *product_ids[i:i + cls.DIRTY_MARK_CHUNK_SIZE])
+            pipe.execute()
         except Exception as e:
             cls.logger.error(
-                f"Error for product {product_id} : {e}")
+                f"Error for products {product_ids} : {e}")
             
     @classmethod
     def decrement_physical_stock(cls, product, quantity):
+        cls.decrement_physical_stocks({product.pk: quantity})
         product.physical_stock -= quantity
-        cls.save_product(product)
+
+    @classmethod
+    def decrement_physical_stocks(cls, quantities):
+        """
+        Decrements physical stock for {product_id: quantity} in a single UPDATE
+        """
+        quantities = {pid: qty for pid, qty in quantities.items() if qty}
+        if not quantities:
+            return
+
+        Product.objects.filter(pk__in=quantities.keys()).update(
+            physical_stock=F('physical_stock') - Case(
+                *[When(pk=pid, then=Value(qty)) for pid, qty in quantities.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
+        cls.mark_products_as_dirty(quantities.keys())
@@ -0,0 +1,39 @@
+from django.conf import settings
+import redis
+import threading
+import uuid
+
+_pool = None
+_pool_lock = threading.Lock()
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+def get_redis_client():
+    """
+    Returns a client backed by a process-wide connection pool.
+    redis-py resets the pool's connections after a fork, so this is safe in Celery workers.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = redis.ConnectionPool.from_url(settings.REDIS_URL)
+    return redis.Redis(connection_pool=_pool)
+
+def acquire_lock(client, key, ttl):
+    """
+    Single-flight lock: returns a token when acquired, None if someone else holds it.
+    """
+    token = uuid.uuid4().hex
+    if client.set(key, token, nx=True, ex=ttl):
+        return token
+    return None
+
+def release_lock(client, key, token):
+    # Only delete the lock if it is still ours (it may have expired and been re-acquired)
+    client.eval(RELEASE_LOCK_SCRIPT, 1, key, token)
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from django.conf import settings
+from business.shopify_client import ShopifyClient
+
+try:
+    import httpx
+except ImportError:  # optional dependency, the thread pool transport is used without it
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+def async_transport_enabled():
+    if settings.SHOPIFY_TRANSPORT != "async":
+        return False
+    if httpx is None:
+        logger.warning("SHOPIFY_TRANSPORT is 'async' but httpx is not installed, falling back to threads")
+        return False
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return True
+    # Already inside an event loop, the sync facade can't start another one
+    return False
+
+class AsyncShopifyTransport:
+    """
+    Runs many GraphQL calls concurrently on a single event loop, bounded globally
+    and per shop. Pacing, cost tracking and retries reuse the per-shop ShopifyClient
+    rate limiters, so async and threaded calls share the same budget.
+    """
+
+    def __init__(self, max_concurrency=None, per_shop_concurrency=None):
+        self.max_concurrency = max_concurrency or settings.SHOPIFY_ASYNC_MAX_CONCURRENCY
+        self.per_shop_concurrency = per_shop_concurrency or settings.SHOPIFY_ASYNC_PER_SHOP_CONCURRENCY
+
+    def run_graphql(self, calls):
+        """
+        Sync facade: takes [(config, query, variables)] and returns the decoded
+        responses in the same order, or the exception raised by each call.
+        """
+        if not calls:
+            return []
+        return asyncio.run(self._gather(calls))
+
+    async def _gather(self, calls):
+        limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        timeout = httpx.Timeout(settings.SHOPIFY_READ_TIMEOUT, connect=settings.SHOPIFY_CONNECT_TIMEOUT)
+        global_limit = asyncio.Semaphore(self.max_concurrency)
+        shop_limits = {}
+
+        async with httpx.AsyncClient(limits=limits, timeout=timeout) as http:
+            async def run(config, query, variables):
+                shop_limit = shop_limits.setdefault(config.shop_url, asyncio.Semaphore(self.per_shop_concurrency))
+                async with global_limit, shop_limit:
+                    return await self._graphql(http, ShopifyClient.for_config(config), query, variables)
+
+            return await asyncio.gather(
+                *(run(config, query, variables) for config, query, variables in calls),
+                return_exceptions=True
+            )
+
+    async def _graphql(self, http, client, query, variables):
+        cost = client.estimated_cost(query)
+        max_retries = settings.SHOPIFY_MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            await asyncio.sleep(client.graphql_limiter.reserve(cost))
+            response = await http.post(
+                client.api_url("graphql.json"),
+                json={"query": query, "variables": variables},
+                headers=client.headers,
+            )
+            if response.status_code == 429 and attempt < max_retries:
+                await self._backoff(client, attempt, ShopifyClient.retry_after(response))
+                continue
+            response.raise_for_status()
+
+            data = response.json()
+            client.record_graphql_cost(query, data)
+            if client.is_throttled(data) and attempt < max_retries:
+                await self._backoff(client, attempt, client.graphql_limiter.wait_for(cost))
+                continue
+            return data
+
+    async def _backoff(self, client, attempt, minimum=0):
+        delay = client.backoff_delay(attempt, minimum)
+        logger.warning(f"Throttled by {client.shop_url}, retrying in {delay:.1f}s (attempt {attempt + 1})")
+        await asyncio.sleep(delay)
@@ -0,0 +1,216 @@
+import logging
+import random
+import threading
+import time
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+class ShopifyRateLimiter:
+    """
+    Client-side model of a Shopify leaky bucket. Requests reserve their expected cost
+    ahead of time and wait when the bucket would run dry, the server metadata
+    (call limit header, GraphQL throttleStatus) resynchronizes it after each response.
+    """
+
+    def __init__(self, capacity, restore_rate):
+        self.capacity = capacity
+        self.restore_rate = restore_rate
+        self.available = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.restore_rate)
+        self.updated_at = now
+
+    def reserve(self, cost):
+        """
+        Takes cost from the bucket and returns how many seconds to wait before sending.
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.available -= min(cost, self.capacity)
+            if self.available >= 0:
+                return 0
+            return -self.available / self.restore_rate
+
+    def update(self, available, capacity=None, restore_rate=None):
+        with self.lock:
+            if capacity:
+                self.capacity = capacity
+            if restore_rate:
+                self.restore_rate = restore_rate
+            self.available = min(self.capacity, available)
+            self.updated_at = time.monotonic()
+
+    def wait_for(self, cost):
+        """
+        Seconds until the bucket holds cost points again.
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            missing = min(cost, self.capacity) - self.available
+            return max(0, missing / self.restore_rate)
+
+class ShopifyClient:
+    """
+    HTTP client for one shop: a keep-alive session with pooled connections,
+    connect/read timeouts and the API version in a single place.
+    Requests are paced against the shop's REST and GraphQL rate limits and
+    throttled calls are retried with backoff.
+    Use ShopifyClient.for_config() to get the per-process cached instance.
+    """
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    # Standard plan limits, corrected from the response metadata as soon as we get some
+    REST_BUCKET_SIZE = 40
+    REST_RESTORE_RATE = 2
+    GRAPHQL_BUCKET_SIZE = 1000
+    GRAPHQL_RESTORE_RATE = 50
+
+    def __init__(self, shop_url, access_token):
+        self.shop_url = shop_url
+        self.access_token = access_token
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.SHOPIFY_HTTP_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.rest_limiter = ShopifyRateLimiter(self.REST_BUCKET_SIZE, self.REST_RESTORE_RATE)
+        self.graphql_limiter = ShopifyRateLimiter(self.GRAPHQL_BUCKET_SIZE, self.GRAPHQL_RESTORE_RATE)
+        self._query_costs = {}
+
+    @classmethod
+    def for_config(cls, config):
+        key = (config.shop_url, config.access_token)
+        client = cls._clients.get(config.pk)
+        if client is not None and (client.shop_url, client.access_token) == key:
+            return client
+
+        with cls._clients_lock:
+            client = cls._clients.get(config.pk)
+            if client is None or (client.shop_url, client.access_token) != key:
+                if client is not None:
+                    client.close()
+                client = cls(config.shop_url, config.access_token)
+                cls._clients[config.pk] = client
+            return client
+
+    @property
+    def timeout(self):
+        return (settings.SHOPIFY_CONNECT_TIMEOUT, settings.SHOPIFY_READ_TIMEOUT)
+
+    @property
+    def headers(self):
+        return {"X-Shopify-Access-Token": self.access_token, "Content-Type": "application/json"}
+
+    def api_url(self, path):
+        return f"https://{self.shop_url}/admin/api/{settings.SHOPIFY_API_VERSION}/{path}"
+
+    def graphql(self, query, variables=None):
+        """
+        Returns the decoded GraphQL response, raises on HTTP errors.
+        """
+        cost = self.estimated_cost(query)
+        max_retries = settings.SHOPIFY_MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            time.sleep(self.graphql_limiter.reserve(cost))
+            response = self.session.post(
+                self.api_url("graphql.json"),
+                json={"query": query, "variables": variables},
+                headers=self.headers,
+                timeout=self.timeout,
+            )
+            if response.status_code == 429 and attempt < max_retries:
+                self._backoff(attempt, self.retry_after(response))
+                continue
+            response.raise_for_status()
+
+            data = response.json()
+            self.record_graphql_cost(query, data)
+            if self.is_throttled(data) and attempt < max_retries:
+                self._backoff(attempt, self.graphql_limiter.wait_for(cost))
+                continue
+            return data
+
+    def get(self, path_or_url, params=None):
+        """
+        GET on a REST path (e.g. "orders.json") or on a full URL such as a Link header cursor.
+        """
+        url = path_or_url if path_or_url.startswith("https://") else self.api_url(path_or_url)
+        max_retries = settings.SHOPIFY_MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            time.sleep(self.rest_limiter.reserve(1))
+            response = self.session.get(url, params=params, headers=self.headers, timeout=self.timeout)
+            self.record_rest_limit(response)
+            if response.status_code == 429 and attempt < max_retries:
+                self._backoff(attempt, self.retry_after(response))
+                continue
+            response.raise_for_status()
+            return response
+
+    def stream(self, url):
+        """
+        Streams an external download (bulk operation results), without the shop credentials.
+        """
+        response = self.session.get(url, stream=True, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def close(self):
+        self.session.close()
+
+    def estimated_cost(self, query):
+        return self._query_costs.get(query, settings.SHOPIFY_GRAPHQL_DEFAULT_COST)
+
+    def record_graphql_cost(self, query, data):
+        cost = (data.get("extensions") or {}).get("cost") or {}
+        if cost.get("requestedQueryCost"):
+            self._query_costs[query] = cost["requestedQueryCost"]
+
+        throttle = cost.get("throttleStatus")
+        if throttle:
+            self.graphql_limiter.update(
+                throttle.get("currentlyAvailable", 0),
+                capacity=throttle.get("maximumAvailable"),
+                restore_rate=throttle.get("restoreRate"),
+            )
+
+    def record_rest_limit(self, response):
+        # e.g. "32/40": 32 calls in the bucket out of 40
+        call_limit = response.headers.get("X-Shopify-Shop-Api-Call-Limit")
+        if not call_limit:
+            return
+        try:
+            used, capacity = (int(part) for part in call_limit.split("/"))
+        except ValueError:
+            return
+        self.rest_limiter.update(capacity - used, capacity=capacity)
+
+    @staticmethod
+    def is_throttled(data):
+        return any(
+            (error.get("extensions") or {}).get("code") == "THROTTLED"
+            for error in data.get("errors") or []
+            if isinstance(error, dict)
+        )
+
+    @staticmethod
+    def retry_after(response):
+        try:
+            return float(response.headers.get("Retry-After", 0))
+        except ValueError:
+            return 0
+
+    def backoff_delay(self, attempt, minimum=0):
+        delay = min(settings.SHOPIFY_RETRY_MAX_DELAY, settings.SHOPIFY_RETRY_BASE_DELAY * 2 ** attempt)
+        # Full jitter on top of what the shop asked for, so concurrent workers don't retry in lockstep
+        return max(minimum, 0) + random.uniform(0, delay)
+
+    def _backoff(self, attempt, minimum=0):
+        delay = self.backoff_delay(attempt, minimum)
+        logger.warning(f"Throttled by {self.shop_url}, retrying in {delay:.1f}s (attempt {attempt + 1})")
+        time.sleep(delay)
@@ -1,43 +1,327 @@
+import hashlib
+import json
 import logging
-import requests
+import time
+from decimal import Decimal
 from datetime import timedelta
+from django.conf import settings
+from django.db import DataError, IntegrityError, transaction
 from django.utils import timezone
 from domain.models import Order, Product, ShopifyConfig, ShopifyOrder
 from business.order_repo import OrderRepository
+from business.redis_client import get_redis_client, acquire_lock, release_lock
+from business.shopify_client import ShopifyClient
 
 logger = logging.getLogger(__name__)
 
 class ShopifyOrderService:
+    WEBHOOK_TOPICS = {
+        "ORDERS_CREATE": "create",
+        "ORDERS_UPDATED": "updated",
+        "ORDERS_CANCELLED": "cancelled",
+    }
+
     @classmethod
     def sync_all_active_shops(cls):
         configs = ShopifyConfig.objects.filter(active=True)
         results = {}
         for config in configs:
-            results[config.shop_url] = cls.sync_store_orders(config)
+            results[config.shop_url] = cls.sync_store_orders_locked(config)
         return results
 
+    @classmethod
+    def sync_store_orders_locked(cls, config):
+        """
+        Runs sync_store_orders under a per-shop Redis lock so two runs for the same shop never overlap.
+        """
+        try:
+            client = get_redis_client()
+            lock_key = f"shopify:order_sync_lock:{config.pk}"
+            token = acquire_lock(client, lock_key, ttl=settings.SHOPIFY_ORDER_SYNC_LOCK_TTL)
+        except Exception as e:
+            logger.error(f"Could not acquire sync lock for {config.shop_url}: {e}")
+            return {"created": 0, "updated": 0, "error": str(e)}
+
+        if not token:
+            logger.info(f"Sync already running for {config.shop_url}, skipping")
+            return {"created": 0, "updated": 0, "error": "Sync already running"}
+
+        try:
+            return cls.sync_store_orders(config)
+        finally:
+            try:
+                release_lock(client, lock_key, token)
+            except Exception as e:
+                # The lock expires with its TTL
+                logger.error(f"Could not release sync lock for {config.shop_url}: {e}")
+
     @classmethod
     def sync_store_orders(cls, config):
         shop_url = config.shop_url
-        access_token = config.access_token
-        
-        url = f"https://{shop_url}/admin/api/2024-01/orders.json"
-        headers = {"X-Shopify-Access-Token": access_token, "Content-Type": "application/json"}
-        params = {"status": "any", "limit": 250, "updated_at_min": cls._get_last_sync_time(config)}
+        started_at = timezone.now()
+        stats = {"created": 0, "updated": 0}
 
         try:
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            orders_data = response.json().get("orders", [])
-            
-            stats = cls._process_orders_batch(orders_data, config)
-            
-            config.last_sync_at = timezone.now()
-            config.save()
+            for orders_data in cls._iter_order_pages(config):
+                page_stats = cls._process_orders_batch(orders_data, config)
+                for key, value in page_stats.items():
+                    stats[key] = stats.get(key, 0) + value
+
+            # Only advance once every page is committed, from the start time so
+            # orders updated while we were paging are picked up next run
+            config.last_sync_at = started_at
+            config.save(update_fields=['last_sync_at', 'updated_at'])
             return stats
         except Exception as e:
             logger.error(f"Error syncing {shop_url}: {e}")
-            return {"created": 0, "updated": 0, "error": str(e)}
+            return {**stats, "error": str(e)}
+
+    @classmethod
+    def _iter_order_pages(cls, config):
+        """
+        Yields one page of orders at a time, following the Link header cursor.
+        """
+        client = ShopifyClient.for_config(config)
+        url = "orders.json"
+        params = {"status": "any", "limit": 250, "updated_at_min": cls._get_last_sync_time(config)}
+
+        while url:
+            response = client.get(url, params=params)
+            yield response.json().get("orders", [])
+
+            url = response.links.get("next", {}).get("url")
+            # The next URL carries page_info and limit, other filters are not allowed with it
+            params = None
+
+    @classmethod
+    def process_webhook_order(cls, config, data):
+        """
+        Ingests one order payload from an orders/* webhook through the batch path.
+        """
+        return cls._process_orders_batch([data], config)
+
+    @classmethod
+    def backfill_store_orders(cls, config, since=None, jsonl_path=None):
+        """
+        Backfills orders through a GraphQL bulk operation, streaming the JSONL
+        result into the batch ingest one page at a time.
+        jsonl_path replays a previously downloaded result file instead of calling Shopify.
+        """
+        started_at = timezone.now()
+        stats = {"created": 0, "updated": 0}
+
+        try:
+            if jsonl_path:
+                lines = cls._iter_file_lines(jsonl_path)
+            else:
+                url = cls._run_bulk_orders_query(config, since)
+                lines = cls._iter_url_lines(config, url) if url else iter(())
+
+            for orders_data in cls._batched(cls._iter_bulk_orders(lines), settings.SHOPIFY_BULK_INGEST_BATCH_SIZE):
+                page_stats = cls._process_orders_batch(orders_data, config)
+                for key, value in page_stats.items():
+                    stats[key] = stats.get(key, 0) + value
+
+            if not jsonl_path and not since:
+                # A full export covers everything up to its start
+                config.last_sync_at = started_at
+                config.save(update_fields=['last_sync_at', 'updated_at'])
+            return stats
+        except Exception as e:
+            logger.error(f"Error backfilling {config.shop_url}: {e}")
+            return {**stats, "error": str(e)}
+
+    @classmethod
+    def _run_bulk_orders_query(cls, config, since=None):
+        """
+        Starts the bulk operation and waits for it. Returns the result URL (None when there are no orders).
+        """
+        search = f'query: "updated_at:>=\'{since.isoformat()}\'"' if since else ""
+        bulk_query = """
+        {
+          orders%s {
+            edges {
+              node {
+                id
+                legacyResourceId
+                name
+                email
+                cancelledAt
+                displayFinancialStatus
+                displayFulfillmentStatus
+                shippingAddress { name address1 zip countryCodeV2 }
+                lineItems {
+                  edges {
+                    node {
+                      id
+                      sku
+                      quantity
+                      originalUnitPriceSet { shopMoney { amount } }
+                    }
+                  }
+                }
+              }
+            }
+          }
+        }
+        """ % (f"({search})" if search else "")
+
+        mutation = """
+        mutation bulkOperationRunQuery($query: String!) {
+          bulkOperationRunQuery(query: $query) {
+            bulkOperation { id status }
+            userErrors { field message }
+          }
+        }
+        """
+        response = cls._graphql_request(config, mutation, {"query": bulk_query})
+        result = (response.get("data") or {}).get("bulkOperationRunQuery") or {}
+        if result.get("userErrors") or not result.get("bulkOperation"):
+            raise RuntimeError(f"Could not start bulk operation: {result.get('userErrors') or response}")
+
+        return cls._wait_for_bulk_operation(config, result["bulkOperation"]["id"])
+
+    @classmethod
+    def _wait_for_bulk_operation(cls, config, operation_id):
+        query = """
+        query($id: ID!) {
+          node(id: $id) {
+            ... on BulkOperation { id status errorCode objectCount url }
+          }
+        }
+        """
+        deadline = time.monotonic() + settings.SHOPIFY_BULK_TIMEOUT
+        while time.monotonic() < deadline:
+            response = cls._graphql_request(config, query, {"id": operation_id})
+            operation = (response.get("data") or {}).get("node") or {}
+            status = operation.get("status")
+
+            if status == "COMPLETED":
+                logger.info(f"Bulk operation {operation_id} completed with {operation.get('objectCount')} objects")
+                return operation.get("url")
+            if status in ("FAILED", "CANCELED", "EXPIRED"):
+                raise RuntimeError(f"Bulk operation {operation_id} {status}: {operation.get('errorCode')}")
+
+            time.sleep(settings.SHOPIFY_BULK_POLL_INTERVAL)
+
+        raise RuntimeError(f"Bulk operation {operation_id} did not finish in {settings.SHOPIFY_BULK_TIMEOUT}s")
+
+    @classmethod
+    def _iter_url_lines(cls, config, url):
+        with ShopifyClient.for_config(config).stream(url) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield line
+
+    @classmethod
+    def _iter_file_lines(cls, path):
+        with open(path, encoding="utf-8") as jsonl_file:
+            for line in jsonl_file:
+                line = line.strip()
+                if line:
+                    yield line
+
+    @classmethod
+    def _iter_bulk_orders(cls, lines):
+        """
+        Rebuilds orders from bulk JSONL, where each line item is its own row
+        pointing at the order through __parentId and follows its parent.
+        Yields orders shaped like the REST orders.json payload.
+        Child rows that do not follow their parent are logged and dropped.
+        """
+        current = None
+        orphans = 0
+        for line in lines:
+            row = json.loads(line)
+            parent_id = row.get("__parentId")
+            if parent_id is None:
+                if current is not None:
+                    yield current
+                current = cls._bulk_order_to_rest(row)
+            elif current is not None and parent_id == current["admin_graphql_api_id"]:
+                current["line_items"].append(cls._bulk_line_to_rest(row))
+            else:
+                orphans += 1
+                logger.warning(f"Dropping bulk row {row.get('id')}: parent {parent_id} is not the current order")
+        if current is not None:
+            yield current
+        if orphans:
+            logger.warning(f"Dropped {orphans} bulk rows without a matching parent order")
+
+    @classmethod
+    def _bulk_order_to_rest(cls, node):
+        address = node.get("shippingAddress")
+        return {
+            "id": int(node["legacyResourceId"]),
+            "admin_graphql_api_id": node["id"],
+            # GraphQL only exposes the formatted name, e.g. "#1001"
+            "order_number": (node.get("name") or "").lstrip("#"),
+            "email": node.get("email"),
+            "cancelled_at": node.get("cancelledAt"),
+            "financial_status": (node.get("displayFinancialStatus") or "").lower(),
+            "fulfillment_status": (node.get("displayFulfillmentStatus") or "").lower(),
+            "shipping_address": {
+                key: value for key, value in {
+                    "name": address.get("name"),
+                    "address1": address.get("address1"),
+                    "zip": address.get("zip"),
+                    "country_code": address.get("countryCodeV2"),
+                }.items() if value is not None
+            } if address else None,
+            "line_items": [],
+        }
+
+    @classmethod
+    def _bulk_line_to_rest(cls, node):
+        price_set = node.get("originalUnitPriceSet") or {}
+        return {
+            "sku": node.get("sku"),
+            "quantity": node.get("quantity"),
+            "price": (price_set.get("shopMoney") or {}).get("amount"),
+        }
+
+    @classmethod
+    def _batched(cls, iterable, size):
+        batch = []
+        for item in iterable:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @classmethod
+    def register_order_webhooks(cls, config):
+        if not settings.SHOPIFY_WEBHOOK_BASE_URL:
+            logger.error(f"BACKEND_BASE_URL is not set, order webhooks not registered for {config.shop_url}")
+            return 0
+
+        mutation = """
+        mutation webhookSubscriptionCreate($topic: WebhookSubscriptionTopic!, $subscription: WebhookSubscriptionInput!) {
+          webhookSubscriptionCreate(topic: $topic, webhookSubscription: $subscription) {
+            webhookSubscription { id }
+            userErrors { field message }
+          }
+        }
+        """
+        registered = 0
+        for topic, path in cls.WEBHOOK_TOPICS.items():
+            variables = {
+                "topic": topic,
+                "subscription": {
+                    "callbackUrl": f"{settings.SHOPIFY_WEBHOOK_BASE_URL}/orders/{path}/",
+                    "format": "JSON"
+                }
+            }
+            response = cls._graphql_request(config, mutation, variables)
+            result = (response.get("data") or {}).get("webhookSubscriptionCreate") or {}
+            errors = result.get("userErrors", [])
+            if errors:
+                logger.warning(f"Webhook {topic} registration for {config.shop_url}: {errors}")
+            elif result.get("webhookSubscription"):
+                registered += 1
+        return registered
 
     @classmethod
     def _get_last_sync_time(cls, config):
@@ -47,61 +331,151 @@ class ShopifyOrderService:
 
     @classmethod
     def _process_orders_batch(cls, orders_data, config):
-        created_count = 0
-        updated_count = 0
+        """
+        Ingests a page of Shopify orders with a fixed number of queries:
+        SKUs are resolved at once and orders, lines and links are written in bulk
+        inside one transaction.
+        """
+        products_by_sku = cls._load_products_by_sku(orders_data)
+
+        payloads = {}
+        shopify_ids = {}
         for data in orders_data:
             try:
-                created = cls._process_single_order(data, config)
-                if created: created_count += 1
-                else: updated_count += 1
+                payload = cls._build_order_payload(data, products_by_sku)
+                payloads[payload['reference']] = payload
+                shopify_ids[payload['reference']] = data.get('id')
             except Exception as e:
                 logger.error(f"Error processing order {data.get('order_number')}: {e}")
-        return {"created": created_count, "updated": updated_count}
+
+        hashes = {reference: cls._payload_hash(payload, shopify_ids[reference]) for reference, payload in payloads.items()}
+        known_hashes = dict(
+            ShopifyOrder.objects.filter(
+                config=config, order__reference__in=payloads.keys()
+            ).values_list('order__reference', 'content_hash')
+        )
+        unchanged = [reference for reference in payloads if known_hashes.get(reference) == hashes[reference]]
+        for reference in unchanged:
+            del payloads[reference]
+
+        if not payloads:
+            return {"created": 0, "updated": 0, "skipped": len(unchanged)}
+
+        try:
+            with transaction.atomic():
+                orders, created_references = OrderRepository.bulk_create_update_orders(payloads.values())
+                cls._store_order_links(config, orders, shopify_ids, hashes)
+        except (IntegrityError, DataError, TypeError, ValueError) as e:
+            logger.warning(f"Bulk ingest of {len(payloads)} orders failed for {config.shop_url}, retrying one by one: {e}")
+            orders, created_references = cls._ingest_orders_one_by_one(config, payloads, shopify_ids, hashes)
+
+        created_count = len(created_references)
+        return {"created": created_count, "updated": len(orders) - created_count, "skipped": len(unchanged)}
 
     @classmethod
-    def _process_single_order(cls, data, config):
-        reference = str(data.get('order_number'))
-        is_new = not Order.objects.filter(reference=reference).exists()
+    def _ingest_orders_one_by_one(cls, config, payloads, shopify_ids, hashes):
+        """
+        Fallback of the bulk write: each order in its own savepoint, bad orders are
+        logged and skipped so they never block the rest of the page.
+        """
+        orders = {}
+        created_references = set()
+        for reference, payload in payloads.items():
+            try:
+                with transaction.atomic():
+                    saved, created = OrderRepository.bulk_create_update_orders([payload])
+                    cls._store_order_links(config, saved, shopify_ids, hashes)
+            except Exception as e:
+                logger.error(f"Error processing order {reference}: {e}")
+                continue
+            orders.update(saved)
+            created_references.update(created)
+        return orders, created_references
+
+    @classmethod
+    def _payload_hash(cls, payload, shopify_order_id):
+        """
+        Hash of the normalized order as we would store it, so an order whose SKUs
+        start resolving is not mistaken for an unchanged one.
+        """
+        normalized = {
+            "shopify_order_id": shopify_order_id,
+            "reference": payload["reference"],
+            "customer_email": payload["customer_email"],
+            "status": payload["status"],
+            "shipping_address": payload["shipping_address_data"],
+            "lines": [
+                [line["product"].pk, line["quantity"], str(Decimal(str(line["unit_price"])).quantize(Decimal("0.01")))]
+                for line in payload["order_lines_data"]
+            ],
+        }
+        encoded = json.dumps(normalized, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
 
-        order_lines_data, all_products_exist = cls._extract_lines(data)
+    @classmethod
+    def _build_order_payload(cls, data, products_by_sku):
+        order_lines_data, all_products_exist = cls._extract_lines(data, products_by_sku)
         status = cls._map_status(data, has_error=not all_products_exist)
         
         if status == Order.Status.ERROR:
             order_lines_data = []
 
-        shipping_address_data = cls._extract_address(data)
+        return {
+            "reference": str(data.get('order_number')),
+            "customer_email": data.get("email") or "no-email@example.com",
+            "shipping_address_data": cls._extract_address(data),
+            "order_lines_data": order_lines_data,
+            "status": status,
+        }
+
+    @classmethod
+    def _store_order_links(cls, config, orders, shopify_ids, hashes):
+        existing = {
+            link.order_id: link
+            for link in ShopifyOrder.objects.filter(config=config, order__in=orders.values())
+        }
 
-        order = OrderRepository.create_update_order(
-            reference=reference,
-            customer_email=data.get("email") or "no-email@example.com",
-            shipping_address_data=shipping_address_data,
-            order_lines_data=order_lines_data,
-            status=status
-        )
+        now = timezone.now()
+        to_create = []
+        to_update = []
+        for reference, order in orders.items():
+            shopify_order_id = shopify_ids[reference]
+            link = existing.get(order.pk)
+            if link is None:
+                to_create.append(ShopifyOrder(
+                    config=config, order=order, shopify_order_id=shopify_order_id, content_hash=hashes[reference]
+                ))
+            else:
+                link.shopify_order_id = shopify_order_id
+                link.content_hash = hashes[reference]
+                link.updated_at = now
+                to_update.append(link)
 
-        shopify_order_id = data.get('id')
-        cls._store_order_link(shopify_order_id, order, config)
+        if to_create:
+            ShopifyOrder.objects.bulk_create(to_create)
+        if to_update:
+            ShopifyOrder.objects.bulk_update(to_update, ['shopify_order_id', 'content_hash', 'updated_at'])
 
-        return is_new
-    
     @classmethod
-    def _store_order_link(cls, shopify_order_id, order, config):
-        ShopifyOrder.objects.update_or_create(
-            config=config,
-            order=order,
-            defaults={'shopify_order_id': shopify_order_id}
-        )
-        
+    def _load_products_by_sku(cls, orders_data):
+        skus = {
+            line.get("sku")
+            for data in orders_data
+            for line in data.get("line_items", [])
+            if line.get("sku")
+        }
+        # One lookup on the unique sku index
+        return Product.objects.in_bulk(skus, field_name='sku')
 
     @classmethod
-    def _extract_lines(cls, data):
+    def _extract_lines(cls, data, products_by_sku):
         lines_data_raw = data.get("line_items", [])
         order_lines_data = []
         all_products_exist = True
         
         for line in lines_data_raw:
             sku = line.get("sku")
-            product = Product.objects.filter(sku=sku).first()
+            product = products_by_sku.get(sku)
             if product:
                 order_lines_data.append({
                     "product": product,
@@ -141,12 +515,10 @@ class ShopifyOrderService:
         
         ff_order = cls._fetch_fulfillment(link.config, link.shopify_order_id)
         if ff_order:
-            cls._create_fulfillment(link.config, ff_order, tracking)
+            return cls._create_fulfillment(link.config, ff_order, tracking)
         else:
             logger.warning(f"No fulfillment order found for order {order.reference}")
             return False
-
-        return True
     
     @classmethod
     def _fetch_fulfillment(cls, config, shopify_order_id):
@@ -173,7 +545,7 @@ class ShopifyOrderService:
         """
         variables = {"id": f"gid://shopify/Order/{shopify_order_id}"}
         response = cls._graphql_request(config, query, variables)
-        edges = response.get("data", {}).get("order", {}).get("fulfillmentOrders", {}).get("edges", [])
+        edges = ((response.get("data") or {}).get("order") or {}).get("fulfillmentOrders", {}).get("edges", [])
         return edges[0]["node"] if edges else None
 
     @classmethod
@@ -212,24 +584,20 @@ class ShopifyOrderService:
             }
 
         response = cls._graphql_request(config, mutation, {"fulfillment": input_data})
-        errors = response.get("data", {}).get("fulfillmentCreateV2", {}).get("userErrors", [])
+        result = (response.get("data") or {}).get("fulfillmentCreateV2") or {}
+        errors = result.get("userErrors", [])
         if errors:
             logger.error(f"Fulfillment Error: {errors}")
+            return False
+        return bool(result.get("fulfillment"))
 
     @classmethod
     def _graphql_request(cls, config, query, variables=None):
-        url = f"https://{config.shop_url}/admin/api/2024-10/graphql.json"
-        headers = {
-            "X-Shopify-Access-Token": config.access_token,
-            "Content-Type": "application/json"
-        }
         payload = {"query": query, "variables": variables}
         logger.info(f"GraphQL Request to {config.shop_url}: {payload}")
 
         try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            data = response.json()
+            data = ShopifyClient.for_config(config).graphql(query, variables)
             logger.info(f"GraphQL Response: {data}")
             return data if data is not None else {}
         except Exception as e:
@@ -1,45 +1,195 @@
 import logging
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+from django.conf import settings
+from django.utils import timezone
 from domain.models import ShopifyProduct
+from business.redis_client import get_redis_client
+from business.shopify_client import ShopifyClient
+from business.shopify_async import AsyncShopifyTransport, async_transport_enabled
 
 logger = logging.getLogger(__name__)
 
 class ShopifyProductService:
     @classmethod
     def ensure_shopify_product_link(cls, config, product):
-        link = ShopifyProduct.objects.filter(config=config, product=product).first()
-        if link:
-            return link
-
-        inventory_item_id = cls._fetch_inventory_item_id(config, product.sku)
-        if inventory_item_id:
-            link = ShopifyProduct.objects.create(
-                config=config,
-                product=product,
-                inventory_item_id=inventory_item_id
+        return cls.resolve_product_links(config, [product]).get(product.pk)
+
+    @classmethod
+    def resolve_product_links(cls, config, products):
+        """
+        Returns {product_id: ShopifyProduct} for the products known to the shop.
+        Unresolved SKUs are looked up in batched GraphQL queries, SKUs missing
+        from the shop are remembered for SHOPIFY_MISSING_SKU_TTL seconds.
+        """
+        products = {product.pk: product for product in products}
+        links = {
+            link.product_id: link
+            for link in ShopifyProduct.objects.filter(config=config, product_id__in=products.keys())
+        }
+
+        unresolved = [product for pid, product in products.items() if pid not in links]
+        unresolved = cls._skip_known_missing(config, unresolved)
+        if not unresolved:
+            return links
+
+        chunk_size = settings.SHOPIFY_SKU_RESOLVE_CHUNK_SIZE
+        new_links = []
+        missing_skus = []
+        for i in range(0, len(unresolved), chunk_size):
+            chunk = unresolved[i:i + chunk_size]
+            found = cls._fetch_inventory_item_ids(config, [product.sku for product in chunk])
+            if found is None:
+                continue
+            for product in chunk:
+                inventory_item_id = found.get(product.sku)
+                if inventory_item_id:
+                    new_links.append(ShopifyProduct(
+                        config=config,
+                        product=product,
+                        inventory_item_id=inventory_item_id
+                    ))
+                else:
+                    logger.warning(f"Could not find Shopify variant for SKU {product.sku}")
+                    missing_skus.append(product.sku)
+
+        if new_links:
+            ShopifyProduct.objects.bulk_create(new_links, ignore_conflicts=True)
+            created = ShopifyProduct.objects.filter(
+                config=config, product_id__in=[link.product_id for link in new_links]
             )
-            return link
-        else:
-            logger.warning(f"Could not find Shopify variant for SKU {product.sku}")
-            return None
+            links.update({link.product_id: link for link in created})
+
+        cls._remember_missing(config, missing_skus)
+        return links
+
+    @classmethod
+    def _missing_sku_key(cls, config, sku):
+        return f"shopify:missing_sku:{config.pk}:{sku}"
+
+    @classmethod
+    def _skip_known_missing(cls, config, products):
+        if not products:
+            return products
+        try:
+            client = get_redis_client()
+            cached = client.mget([cls._missing_sku_key(config, product.sku) for product in products])
+        except Exception as e:
+            logger.error(f"Missing SKU cache lookup failed for {config.shop_url}: {e}")
+            return products
+        return [product for product, hit in zip(products, cached) if not hit]
+
+    @classmethod
+    def _remember_missing(cls, config, skus):
+        if not skus:
+            return
+        try:
+            pipe = get_redis_client().pipeline(transaction=False)
+            for sku in skus:
+                pipe.set(cls._missing_sku_key(config, sku), 1, ex=settings.SHOPIFY_MISSING_SKU_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Missing SKU cache update failed for {config.shop_url}: {e}")
 
     @classmethod
     def push_inventory_to_shopify(cls, product):
+        return cls.push_inventory_batch([product])
+
+    @classmethod
+    def push_inventory_batch(cls, products, configs=None, force=False):
+        """
+        Pushes available stock of many products to every active shop.
+        Links and location ids are resolved up front, then the mutations run
+        concurrently with a global and a per-shop concurrency limit.
+        Quantities equal to the last successful push are skipped unless force is set.
+        Returns {shop_url: {sku: success}}
+        """
         from domain.models import ShopifyConfig
-        
-        configs = ShopifyConfig.objects.filter(active=True)
+
+        if configs is None:
+            configs = list(ShopifyConfig.objects.filter(active=True))
+
+        results = {}
+        jobs_by_shop = {}
+        pushed_links = {}
         for config in configs:
-            link = cls.ensure_shopify_product_link(config, product)
-            if link:
-                cls.update_stock(config, link, product.available_stock)
+            items = []
+            links = cls.resolve_product_links(config, products)
+            for product in products:
+                link = links.get(product.pk)
+                if not link:
+                    continue
+                if not force and link.last_pushed_quantity == product.available_stock:
+                    continue
+                link.product = product
+                items.append((link, product.available_stock))
+
+            skipped = len(links) - len(items)
+            if skipped:
+                logger.info(f"[{config.shop_url}] Skipped {skipped} unchanged stock pushes")
+
+            results[config.shop_url] = {}
+            pushed_links[config.shop_url] = items
+            jobs_by_shop[config.shop_url] = cls._prepare_push_jobs(config, items, results[config.shop_url])
+
+        cls._run_push_jobs(jobs_by_shop, results)
+        cls._record_pushed(pushed_links, results)
+        return results
+
+    @classmethod
+    def resync_all_inventory(cls, configs=None, batch_size=500):
+        """
+        Forced full resync: pushes every product to every active shop,
+        ignoring the last pushed quantities.
+        """
+        from domain.models import Product, ShopifyConfig
+
+        if configs is None:
+            configs = list(ShopifyConfig.objects.filter(active=True))
+
+        pushed = 0
+        failed = 0
+        last_pk = 0
+        while True:
+            products = list(Product.objects.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not products:
+                break
+            last_pk = products[-1].pk
+
+            results = cls.push_inventory_batch(products, configs=configs, force=True)
+            for shop_results in results.values():
+                pushed += sum(1 for ok in shop_results.values() if ok)
+                failed += sum(1 for ok in shop_results.values() if not ok)
+        return {"pushed": pushed, "failed": failed}
 
     @classmethod
-    def _fetch_inventory_item_id(cls, config, sku):
+    def _record_pushed(cls, pushed_links, results):
+        now = timezone.now()
+        succeeded = []
+        for shop_url, items in pushed_links.items():
+            shop_results = results.get(shop_url, {})
+            for link, quantity in items:
+                if shop_results.get(link.product.sku):
+                    link.last_pushed_quantity = quantity
+                    link.last_pushed_at = now
+                    succeeded.append(link)
+
+        if succeeded:
+            ShopifyProduct.objects.bulk_update(succeeded, ['last_pushed_quantity', 'last_pushed_at'])
+
+    @classmethod
+    def _fetch_inventory_item_ids(cls, config, skus):
+        """
+        Resolves many SKUs with a single OR-ed productVariants query.
+        Returns {sku: inventory_item_id}, or None when the request failed.
+        """
         query = """
-        query($sku_filter: String!) {
-          productVariants(first: 1, query: $sku_filter) {
+        query($sku_filter: String!, $first: Int!) {
+          productVariants(first: $first, query: $sku_filter) {
             edges {
               node {
+                sku
                 inventoryItem {
                   id
                 }
@@ -48,38 +198,142 @@ class ShopifyProductService:
           }
         }
         """
-        
-        variables = {"sku_filter": f"sku:{sku}"}
-        
-        url = f"https://{config.shop_url}/admin/api/2024-10/graphql.json"
-        headers = {
-            "X-Shopify-Access-Token": config.access_token,
-            "Content-Type": "application/json"
-        }
+
+        sku_filter = " OR ".join(cls._sku_term(sku) for sku in skus)
+        # Several variants may share a SKU, leave room for them
+        variables = {"sku_filter": sku_filter, "first": min(250, len(skus) * 2)}
 
         try:
-            response = requests.post(url, json={"query": query, "variables": variables}, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            edges = data.get("data", {}).get("productVariants", {}).get("edges", [])
-            if not edges:
+            data = ShopifyClient.for_config(config).graphql(query, variables)
+
+            if data.get("errors"):
+                logger.error(f"GraphQL Error for SKUs {skus}: {data['errors']}")
                 return None
-                
-            gid = edges[0]["node"]["inventoryItem"]["id"]
-            return cls._parse_gid(gid)
+            
+            edges = (data.get("data") or {}).get("productVariants", {}).get("edges", [])
+            wanted = set(skus)
+            found = {}
+            for edge in edges:
+                node = edge["node"]
+                sku = node.get("sku")
+                if sku in wanted and sku not in found and node.get("inventoryItem"):
+                    found[sku] = cls._parse_gid(node["inventoryItem"]["id"])
+            return found
             
         except Exception as e:
-            logger.error(f"GraphQL Error for SKU {sku}: {e}")
+            logger.error(f"GraphQL Error for SKUs {skus}: {e}")
             return None
 
+    @classmethod
+    def _sku_term(cls, sku):
+        escaped = sku.replace("\\", "\\\\").replace('"', '\\"')
+        return f'sku:"{escaped}"'
+
     @classmethod
     def update_stock(cls, config, shopify_product, quantity):
+        results = cls.update_stock_batch(config, [(shopify_product, quantity)])
+        return results.get(shopify_product.product.sku, False)
+
+    @classmethod
+    def update_stock_batch(cls, config, items):
+        """
+        Sets quantities for [(shopify_product, quantity)] using chunked multi-item mutations.
+        Returns {sku: success}
+        """
+        results = {config.shop_url: {}}
+        jobs = cls._prepare_push_jobs(config, items, results[config.shop_url])
+        cls._run_push_jobs({config.shop_url: jobs}, results)
+        return results[config.shop_url]
+
+    @classmethod
+    def _prepare_push_jobs(cls, config, items, shop_results):
+        """
+        Splits the items of one shop into (config, location_id, chunk) jobs.
+        Runs in the calling thread as it may hit the database.
+        """
+        if not items:
+            return []
+
         location_id = cls._ensure_location_id(config)
         if not location_id:
             logger.error(f"No location ID found for {config.shop_url}")
-            return False
+            shop_results.update({shopify_product.product.sku: False for shopify_product, _ in items})
+            return []
+
+        chunk_size = settings.SHOPIFY_INVENTORY_PUSH_CHUNK_SIZE
+        return [
+            (config, location_id, items[i:i + chunk_size])
+            for i in range(0, len(items), chunk_size)
+        ]
+
+    @classmethod
+    def _run_push_jobs(cls, jobs_by_shop, results):
+        """
+        Runs the mutations concurrently, on the async transport when enabled,
+        otherwise in a thread pool. Jobs are interleaved across shops so
+        workers don't all queue up behind one shop's concurrency limit.
+        """
+        jobs = [job for round_ in zip_longest(*jobs_by_shop.values()) for job in round_ if job]
+        if not jobs:
+            return
+
+        if async_transport_enabled():
+            cls._run_push_jobs_async(jobs, results)
+            return
+
+        shop_limits = {
+            shop_url: threading.BoundedSemaphore(settings.SHOPIFY_PUSH_PER_SHOP_CONCURRENCY)
+            for shop_url in jobs_by_shop
+        }
+
+        def run(job):
+            config, location_id, chunk = job
+            with shop_limits[config.shop_url]:
+                return config.shop_url, cls._set_quantities(config, location_id, chunk)
+
+        max_workers = min(settings.SHOPIFY_PUSH_MAX_WORKERS, len(jobs))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for shop_url, chunk_results in executor.map(run, jobs):
+                results[shop_url].update(chunk_results)
+
+    @classmethod
+    def _run_push_jobs_async(cls, jobs, results):
+        requests_ = [cls._build_set_quantities(location_id, chunk) for _, location_id, chunk in jobs]
+        responses = AsyncShopifyTransport().run_graphql([
+            (config, mutation, variables)
+            for (config, _, _), (mutation, variables, _) in zip(jobs, requests_)
+        ])
+        for (config, location_id, chunk), (_, _, skus), response in zip(jobs, requests_, responses):
+            if isinstance(response, Exception):
+                logger.error(f"Stock Update Exception: {response}")
+                results[config.shop_url].update({sku: False for sku in skus})
+                continue
+            results[config.shop_url].update(cls._parse_set_quantities(config, skus, response))
+            retry_items = cls._retry_items(chunk, response)
+            if retry_items:
+                results[config.shop_url].update(cls._set_quantities(config, location_id, retry_items, retry=False))
 
+    @classmethod
+    def _set_quantities(cls, config, location_id, items, retry=True):
+        """
+        The mutation is all or nothing: when some items are rejected the others are
+        sent again once without them.
+        """
+        mutation, variables, skus = cls._build_set_quantities(location_id, items)
+        try:
+            data = ShopifyClient.for_config(config).graphql(mutation, variables)
+            results = cls._parse_set_quantities(config, skus, data)
+        except Exception as e:
+            logger.error(f"Stock Update Exception: {e}")
+            return {sku: False for sku in skus}
+
+        retry_items = cls._retry_items(items, data) if retry else None
+        if retry_items:
+            results.update(cls._set_quantities(config, location_id, retry_items, retry=False))
+        return results
+
+    @classmethod
+    def _build_set_quantities(cls, location_id, items):
         mutation = """
         mutation inventorySetQuantities($input: InventorySetQuantitiesInput!) {
           inventorySetQuantities(input: $input) {
@@ -95,7 +349,8 @@ class ShopifyProductService:
           }
         }
         """
-        
+
+        skus = [shopify_product.product.sku for shopify_product, _ in items]
         variables = {
             "input": {
                 "name": "available",
@@ -107,35 +362,50 @@ class ShopifyProductService:
                         "locationId": f"gid://shopify/Location/{location_id}",
                         "quantity": quantity
                     }
+                    for shopify_product, quantity in items
                 ]
             }
         }
+        return mutation, variables, skus
 
-        url = f"https://{config.shop_url}/admin/api/2024-10/graphql.json"
-        headers = {
-            "X-Shopify-Access-Token": config.access_token,
-            "Content-Type": "application/json"
-        }
+    @classmethod
+    def _parse_set_quantities(cls, config, skus, data):
+        logger.info(f"Shopify Stock Update Response for {len(skus)} SKUs on {config.shop_url}: {data}")
 
-        try:
-            response = requests.post(url, json={"query": mutation, "variables": variables}, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            logger.info(f"Shopify Stock Update Response for {shopify_product.product.sku}: {data}")
+        if data.get("errors"):
+            logger.error(f"Shopify Stock Update Error: {data['errors']}")
+            return {sku: False for sku in skus}
 
-            result = data.get("data", {}).get("inventorySetQuantities", {})
-            user_errors = result.get("userErrors", [])
-            
-            if user_errors:
-                logger.error(f"Shopify Stock Update Error: {user_errors}")
-                return False
-                
-            return True
+        result = (data.get("data") or {}).get("inventorySetQuantities") or {}
+        user_errors = result.get("userErrors") or []
+        for error in user_errors:
+            logger.error(f"Shopify Stock Update Error: {error}")
+        # The mutation is all or nothing: with userErrors and no adjustment group, no quantity was set.
+        # Without any error the group is only missing when every quantity was already right.
+        applied = bool(result.get("inventoryAdjustmentGroup")) or (bool(result) and not user_errors)
+        return {sku: applied for sku in skus}
 
-        except Exception as e:
-            logger.error(f"Stock Update Exception: {e}")
-            return False
+    @classmethod
+    def _retry_items(cls, items, data):
+        """
+        Items of a rejected mutation worth sending again: every item unless the
+        userErrors point at it through their field path, e.g.
+        ["input", "quantities", "3", "inventoryItemId"]. Errors without an item
+        index mean the whole mutation is wrong, nothing is retried.
+        """
+        result = (data.get("data") or {}).get("inventorySetQuantities") or {}
+        user_errors = result.get("userErrors") or []
+        if data.get("errors") or result.get("inventoryAdjustmentGroup") or not user_errors:
+            return []
+
+        rejected = set()
+        for error in user_errors:
+            field = error.get("field") or []
+            if len(field) >= 3 and field[1] == "quantities" and str(field[2]).isdigit():
+                rejected.add(int(field[2]))
+            else:
+                return []
+        return [item for index, item in enumerate(items) if index not in rejected]
 
     @classmethod
     def _ensure_location_id(cls, config):
@@ -154,16 +424,8 @@ class ShopifyProductService:
         }
         """
         
-        url = f"https://{config.shop_url}/admin/api/2024-10/graphql.json"
-        headers = {
-            "X-Shopify-Access-Token": config.access_token,
-            "Content-Type": "application/json"
-        }
-
         try:
-            response = requests.post(url, json={"query": query}, headers=headers)
-            response.raise_for_status()
-            data = response.json()
+            data = ShopifyClient.for_config(config).graphql(query)
             
             edges = data.get("data", {}).get("locations", {}).get("edges", [])
             if not edges:
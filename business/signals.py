@@ -0,0 +1,12 @@
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from domain.models import Order
+from business.products import ProductService
+
+@receiver(pre_delete, sender=Order)
+def release_deleted_order(sender, instance, **kwargs):
+    """
+    Deleted orders (API, admin or queryset delete) take their lines with them,
+    their reservation has to be released while the lines still exist.
+    """
+    ProductService.release_order(instance)
@@ -1,56 +1,181 @@
-from celery import shared_task
+from celery import chord, group, shared_task
 from django.conf import settings
 from .products import ProductService
 from business.shopify_orders import ShopifyOrderService
 from business.shopify_products import ShopifyProductService
+from business.fulfillments import FulfillmentService
 from domain.models import ShopifyConfig
-import redis
+from business.redis_client import get_redis_client, acquire_lock, release_lock
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
-def get_redis_client():
-    return redis.Redis.from_url(settings.REDIS_URL)
+def _drain_batch_size(backlog):
+    return max(
+        settings.INVENTORY_DRAIN_MIN_BATCH,
+        min(settings.INVENTORY_DRAIN_MAX_BATCH, backlog // settings.INVENTORY_DRAIN_BACKLOG_DIVISOR)
+    )
+
+def _process_inventory_batch(client, key, product_ids):
+    pids = []
+    for pid_bytes in product_ids:
+        try:
+            pids.append(int(pid_bytes))
+        except ValueError:
+            logger.error(f"Invalid product ID {pid_bytes!r} in dirty set")
+
+    try:
+        products = ProductService.recalculate_inventory_bulk(pids)
+    except Exception:
+        # Put the batch back so the next run retries it
+        if pids:
+            client.sadd(key, *pids)
+        raise
+
+    try:
+        results = ShopifyProductService.push_inventory_batch(products)
+    except Exception as e:
+        logger.error(f"Error pushing inventory for {len(products)} products: {e}")
+        return 0
+
+    for shop_url, shop_results in results.items():
+        failed = [sku for sku, ok in shop_results.items() if not ok]
+        if failed:
+            logger.error(f"[{shop_url}] Inventory push failed for {len(failed)} SKUs: {failed}")
+    return len(products)
 
 @shared_task
 def recalculate_inventory_task():
     """
-    Calculate available stock for products flagged
+    Drain the dirty product set: calculate available stock for flagged products
+    until the set is empty or the time budget is spent, then reschedule if needed.
     """
     client = get_redis_client()
     key = settings.REDIS_INVENTORY_DIRTY_SET_KEY
+    lock_key = settings.INVENTORY_DRAIN_LOCK_KEY
+    time_budget = settings.INVENTORY_DRAIN_TIME_BUDGET
     processed_count = 0
-    
+
+    try:
+        token = acquire_lock(client, lock_key, ttl=int(time_budget * 3))
+    except Exception as e:
+        logger.error(f"Error in recalculate_inventory_task: {e}")
+        return f"Error: {e}"
+    if not token:
+        return "Inventory drain already running."
+
+    reschedule = False
     try:
-        product_ids = client.spop(key, count=10)
-        
-        if not product_ids:
-            return "No products to process."
-
-        logger.info(f"Recalculating inventory for {len(product_ids)} products...")
-        
-        for pid_bytes in product_ids:
-            try:
-                pid = int(pid_bytes)
-                product = ProductService.recalculate_inventory(pid)
-                if product:
-                    ShopifyProductService.push_inventory_to_shopify(product)
-                processed_count += 1
-            except Exception as e:
-                logger.error(f"Error processing product ID {pid_bytes}: {e}")
-                
-        return f"Processed {processed_count} products."
+        deadline = time.monotonic() + time_budget
+        while True:
+            backlog = client.scard(key)
+            if not backlog:
+                break
+            if time.monotonic() >= deadline:
+                reschedule = True
+                break
+
+            batch_size = _drain_batch_size(backlog)
+            product_ids = client.spop(key, count=batch_size)
+            if not product_ids:
+                break
+
+            logger.info(f"Recalculating inventory for {len(product_ids)} products (backlog {backlog})...")
+            processed_count += _process_inventory_batch(client, key, product_ids)
 
     except Exception as e:
         logger.error(f"Error in recalculate_inventory_task: {e}")
         return f"Error: {e}"
+    finally:
+        try:
+            release_lock(client, lock_key, token)
+        except Exception as e:
+            # The lock expires with its TTL
+            logger.error(f"Could not release the inventory drain lock: {e}")
+
+    if reschedule:
+        logger.info("Inventory drain time budget spent, rescheduling.")
+        recalculate_inventory_task.apply_async()
+
+    if not processed_count:
+        return "No products to process."
+    return f"Processed {processed_count} products."
 
 @shared_task
 def sync_shopify_orders_task():
     """
-    Sync orders from all active Shopify stores.
+    Sync orders from all active Shopify stores, one task per shop running in parallel.
+    """
+    config_ids = list(ShopifyConfig.objects.filter(active=True).values_list('pk', flat=True))
+    if not config_ids:
+        return "No active shops."
+
+    logger.info(f"Starting Shopify Order Sync for {len(config_ids)} shops...")
+    chord(shop_sync_group(config_ids))(collect_shop_sync_results.s())
+    return f"Dispatched {len(config_ids)} shop syncs."
+
+def shop_sync_group(config_ids):
+    return group(sync_shop_orders_task.s(config_id) for config_id in config_ids)
+
+@shared_task
+def sync_shop_orders_task(config_id):
+    """
+    Sync orders from a single Shopify store.
+    """
+    config = ShopifyConfig.objects.filter(pk=config_id, active=True).first()
+    if not config:
+        return {"shop": None, "stats": {"error": f"No active config {config_id}"}}
+    return {"shop": config.shop_url, "stats": ShopifyOrderService.sync_store_orders_locked(config)}
+
+@shared_task
+def collect_shop_sync_results(results):
+    merged = {result["shop"]: result["stats"] for result in results if result["shop"]}
+    logger.info(f"Shopify Order Sync Finished: {merged}")
+    return merged
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=30)
+def process_shopify_order_webhook_task(self, shop_domain, topic, payload):
+    """
+    Ingest an order delivered by a Shopify webhook.
+    """
+    config = ShopifyConfig.objects.filter(shop_url=shop_domain, active=True).first()
+    if not config:
+        logger.warning(f"Webhook {topic} for unknown or inactive shop {shop_domain}")
+        return None
+
+    try:
+        stats = ShopifyOrderService.process_webhook_order(config, payload)
+    except Exception as e:
+        logger.error(f"Error processing webhook {topic} for order {payload.get('order_number')}: {e}")
+        raise self.retry(exc=e)
+
+    logger.info(f"Webhook {topic} from {shop_domain} processed: {stats}")
+    return stats
+
+@shared_task
+def dispatch_fulfillment_task(entry_id):
+    """
+    Deliver one fulfillment from the outbox right after the shipping transaction commits.
+    """
+    return FulfillmentService.dispatch(entry_id)
+
+@shared_task
+def dispatch_fulfillment_outbox_task():
+    """
+    Sweep the outbox for due retries and entries whose immediate dispatch was lost.
+    """
+    stats = FulfillmentService.dispatch_due()
+    if stats:
+        logger.info(f"Fulfillment outbox dispatched: {stats}")
+    return stats
+
+@shared_task
+def resync_inventory_to_shopify_task():
+    """
+    Push every product's stock to all active shops, bypassing change suppression.
     """
-    logger.info("Starting Shopify Order Sync...")
-    results = ShopifyOrderService.sync_all_active_shops()
-    logger.info(f"Shopify Order Sync Finished: {results}")
-    return results
\ No newline at end of file
+    logger.info("Starting full Shopify inventory resync...")
+    stats = ShopifyProductService.resync_all_inventory()
+    logger.info(f"Shopify inventory resync finished: {stats}")
+    return stats
@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-17 22:31
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+NON_RESERVING_STATUSES = ['CANCELED', 'SHIPPED', 'ERROR']
+
+
+def backfill_reserved_stock(apps, schema_editor):
+    Product = apps.get_model('domain', 'Product')
+    OrderLine = apps.get_model('domain', 'OrderLine')
+
+    rows = OrderLine.objects.exclude(
+        order__status__in=NON_RESERVING_STATUSES
+    ).values('product_id').annotate(total_reserved=Sum('quantity'))
+
+    for row in rows:
+        Product.objects.filter(pk=row['product_id']).update(reserved_stock=row['total_reserved'] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domain', '0004_shopifyorder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved_stock',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_reserved_stock, migrations.RunPython.noop),
+    ]
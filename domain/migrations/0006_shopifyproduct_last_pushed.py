@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-17 22:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domain', '0005_product_reserved_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopifyproduct',
+            name='last_pushed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shopifyproduct',
+            name='last_pushed_quantity',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 22:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domain', '0006_shopifyproduct_last_pushed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopifyorder',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
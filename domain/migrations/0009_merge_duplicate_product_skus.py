@@ -0,0 +1,71 @@
+# Generated by Django 6.0 on 2026-10-17 23:05
+
+import logging
+
+from django.db import migrations
+from django.db.models import Count, Min, Sum
+
+logger = logging.getLogger(__name__)
+
+
+NON_RESERVING_STATUSES = ['CANCELED', 'SHIPPED', 'ERROR']
+
+
+def merge_duplicate_skus(apps, schema_editor):
+    """
+    Folds products sharing a SKU into the lowest id, the one SKU lookups already picked.
+    Its name is kept and the physical stock of the duplicates is added to its own: every
+    row counted real units, so nothing on the shelf is lost. The lines and Shopify links
+    of the duplicates are moved onto it and reserved/available stock are recomputed.
+    Each merged SKU is logged with the quantities folded in.
+    """
+    Product = apps.get_model('domain', 'Product')
+    OrderLine = apps.get_model('domain', 'OrderLine')
+    ShopifyProduct = apps.get_model('domain', 'ShopifyProduct')
+
+    duplicated = Product.objects.values('sku').annotate(count=Count('id'), keep_id=Min('id')).filter(count__gt=1)
+    for row in duplicated:
+        keep_id = row['keep_id']
+        duplicates = dict(
+            Product.objects.filter(sku=row['sku']).exclude(pk=keep_id).values_list('pk', 'physical_stock')
+        )
+        duplicate_ids = list(duplicates)
+
+        OrderLine.objects.filter(product_id__in=duplicate_ids).update(product_id=keep_id)
+
+        # One link per shop: the kept product's link wins, then the oldest one
+        linked_configs = set(ShopifyProduct.objects.filter(product_id=keep_id).values_list('config_id', flat=True))
+        for link in ShopifyProduct.objects.filter(product_id__in=duplicate_ids).order_by('pk'):
+            if link.config_id in linked_configs:
+                link.delete()
+                continue
+            link.product_id = keep_id
+            link.last_pushed_quantity = None
+            link.save(update_fields=['product', 'last_pushed_quantity'])
+            linked_configs.add(link.config_id)
+
+        Product.objects.filter(pk__in=duplicate_ids).delete()
+
+        reserved = OrderLine.objects.filter(product_id=keep_id).exclude(
+            order__status__in=NON_RESERVING_STATUSES
+        ).aggregate(total=Sum('quantity'))['total'] or 0
+        product = Product.objects.get(pk=keep_id)
+        logger.warning(
+            f"Merged SKU {row['sku']}: products {duplicate_ids} folded into {keep_id}, "
+            f"physical stock {product.physical_stock} + {list(duplicates.values())}"
+        )
+        product.physical_stock += sum(duplicates.values())
+        product.reserved_stock = reserved
+        product.available_stock = product.physical_stock - reserved
+        product.save(update_fields=['physical_stock', 'reserved_stock', 'available_stock'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domain', '0008_fulfillmentoutbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_skus, migrations.RunPython.noop),
+    ]
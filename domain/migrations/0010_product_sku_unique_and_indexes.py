@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-17 23:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domain', '0009_merge_duplicate_product_skus'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(max_length=20, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at', 'id'], name='order_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderline',
+            index=models.Index(fields=['product', 'order', 'quantity'], name='orderline_product_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shopifyorder',
+            index=models.Index(fields=['config', 'shopify_order_id'], name='shopify_order_remote_id_idx'),
+        ),
+    ]
@@ -1,10 +1,12 @@
 from django.db import models
+from django.utils import timezone
 
 class Product(models.Model):
-    sku = models.CharField(max_length=20)
+    sku = models.CharField(max_length=20, unique=True)
     name = models.CharField(max_length=40)
     physical_stock = models.IntegerField()
     available_stock = models.IntegerField()
+    reserved_stock = models.IntegerField(default=0)
     pictureUrl = models.CharField(max_length=200)
 
     def save(self, *args, **kwargs):
@@ -41,6 +43,14 @@ class Order(models.Model):
         default=Status.WAITING_PAYMENT,
     )
 
+    class Meta:
+        indexes = [
+            # Filtered listing: status / status__in ordered by date
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            # Cursor pagination and date range exports
+            models.Index(fields=['created_at', 'id'], name='order_created_id_idx'),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} ({self.get_status_display()})"
 
@@ -50,6 +60,12 @@ class OrderLine(models.Model):
     quantity = models.IntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            # Covers the reserved stock aggregate: lines by product, joined to their order, summing quantity
+            models.Index(fields=['product', 'order', 'quantity'], name='orderline_product_order_idx'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.sku}"
 
@@ -69,6 +85,8 @@ class ShopifyProduct(models.Model):
     config = models.ForeignKey(ShopifyConfig, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     inventory_item_id = models.BigIntegerField()
+    last_pushed_quantity = models.IntegerField(null=True, blank=True)
+    last_pushed_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -83,6 +101,7 @@ class ShopifyOrder(models.Model):
     config = models.ForeignKey(ShopifyConfig, on_delete=models.CASCADE)
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     shopify_order_id = models.BigIntegerField()
+    content_hash = models.CharField(max_length=64, blank=True, default='')
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -92,3 +111,34 @@ class ShopifyOrder(models.Model):
                 name='unique_shopify_order_link'
             )
         ]
+        indexes = [
+            models.Index(fields=['config', 'shopify_order_id'], name='shopify_order_remote_id_idx'),
+        ]
+
+
+class FulfillmentOutbox(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        SENT = 'SENT', 'Sent'
+        DEAD = 'DEAD', 'Dead'
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='fulfillments')
+    tracking = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.PENDING,
+    )
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='fulfillment_outbox_due_idx')
+        ]
+
+    def __str__(self):
+        return f"Fulfillment of {self.order_id} ({self.get_status_display()})"
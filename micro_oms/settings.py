@@ -151,6 +151,17 @@ REST_FRAMEWORK = {
     ]
 }
 
+# Cursor pagination of the list endpoints: default and max rows per page
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
+# Rows fetched per round trip by the streaming exports
+EXPORT_CHUNK_SIZE = 2000
+
+# Max orders per bulk pay / ship / cancel request, max products per bulk upsert
+ORDER_BULK_ACTION_MAX_SIZE = 500
+PRODUCT_BULK_UPSERT_MAX_SIZE = 5000
+
 SHOPIFY_API_KEY = os.getenv('SHOPIFY_API_KEY')
 
 SHOPIFY_API_SECRET = os.getenv('SHOPIFY_API_SECRET')
@@ -159,6 +170,52 @@ SHOPIFY_SCOPES = 'write_inventory,read_inventory,read_orders,write_orders,read_p
 
 SHOPIFY_REDIRECT_URI = f"{os.getenv('BACKEND_BASE_URL')}/api/shopify/callback"
 
+SHOPIFY_API_VERSION = '2024-10'
+
+# Shopify HTTP client: seconds to connect / to wait for a response, keep-alive connections per shop
+SHOPIFY_CONNECT_TIMEOUT = 5
+SHOPIFY_READ_TIMEOUT = 30
+SHOPIFY_HTTP_POOL_SIZE = 10
+
+# Throttling: retries on 429 / THROTTLED with exponential backoff and jitter (seconds),
+# cost assumed for a GraphQL query until Shopify reports its real cost
+SHOPIFY_MAX_RETRIES = 4
+SHOPIFY_RETRY_BASE_DELAY = 1.0
+SHOPIFY_RETRY_MAX_DELAY = 30.0
+SHOPIFY_GRAPHQL_DEFAULT_COST = 50
+
+# 'threads' or 'async' (needs httpx): transport for concurrent Shopify calls, in-flight calls overall / per shop
+SHOPIFY_TRANSPORT = os.getenv('SHOPIFY_TRANSPORT', 'threads')
+SHOPIFY_ASYNC_MAX_CONCURRENCY = 200
+SHOPIFY_ASYNC_PER_SHOP_CONCURRENCY = 10
+
+# Webhooks are not registered without BACKEND_BASE_URL, Shopify needs a reachable callback
+SHOPIFY_WEBHOOK_BASE_URL = (
+    f"{os.getenv('BACKEND_BASE_URL')}/api/shopify/webhooks" if os.getenv('BACKEND_BASE_URL') else None
+)
+
+# Seconds a webhook id is remembered to drop duplicate deliveries
+SHOPIFY_WEBHOOK_DEDUP_TTL = 86400
+
+# Orders arrive through webhooks, polling only reconciles what they missed
+SHOPIFY_ORDER_RECONCILIATION_INTERVAL = 1800.0
+
+# Bulk operation backfill: seconds between status polls, max seconds to wait, orders per ingest batch
+SHOPIFY_BULK_POLL_INTERVAL = 5
+SHOPIFY_BULK_TIMEOUT = 3600
+SHOPIFY_BULK_INGEST_BATCH_SIZE = 250
+
+# Number of quantities sent per inventorySetQuantities mutation (Shopify accepts up to 250)
+SHOPIFY_INVENTORY_PUSH_CHUNK_SIZE = 100
+
+# Concurrent inventory pushes: worker threads overall, in-flight mutations per shop
+SHOPIFY_PUSH_MAX_WORKERS = 8
+SHOPIFY_PUSH_PER_SHOP_CONCURRENCY = 2
+
+# SKU -> inventory item resolution: SKUs per GraphQL lookup, seconds a SKU missing from a shop is cached
+SHOPIFY_SKU_RESOLVE_CHUNK_SIZE = 50
+SHOPIFY_MISSING_SKU_TTL = 3600
+
 
 
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
@@ -169,19 +226,38 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
 CELERY_BEAT_SCHEDULE = {
-    'sync-shopify-orders-every-5-min': {
+    'reconcile-shopify-orders': {
         'task': 'business.tasks.sync_shopify_orders_task',
-        'schedule': 300.0,
+        'schedule': SHOPIFY_ORDER_RECONCILIATION_INTERVAL,
     },
     'recalculate-inventory-every-30-sec': {
         'task': 'business.tasks.recalculate_inventory_task',
         'schedule': 30.0,
     },
+    'dispatch-fulfillment-outbox-every-min': {
+        'task': 'business.tasks.dispatch_fulfillment_outbox_task',
+        'schedule': 60.0,
+    },
 }
 
+# Fulfillment outbox: attempts before an entry is dead-lettered, retry backoff in seconds, entries per sweep
+FULFILLMENT_OUTBOX_MAX_ATTEMPTS = 8
+FULFILLMENT_OUTBOX_BASE_DELAY = 30
+FULFILLMENT_OUTBOX_MAX_DELAY = 3600
+FULFILLMENT_OUTBOX_BATCH_SIZE = 100
+
 REDIS_URL = 'redis://localhost:6379/1'
+# Per-shop order sync lock, should outlive the longest expected sync
+SHOPIFY_ORDER_SYNC_LOCK_TTL = 900
 REDIS_INVENTORY_DIRTY_SET_KEY = "inventory:dirty_products"
 
+# Inventory drainer: batch size grows with the dirty set size, each run stops after the time budget (seconds)
+INVENTORY_DRAIN_LOCK_KEY = "inventory:drain_lock"
+INVENTORY_DRAIN_TIME_BUDGET = 20
+INVENTORY_DRAIN_MIN_BATCH = 10
+INVENTORY_DRAIN_MAX_BATCH = 500
+INVENTORY_DRAIN_BACKLOG_DIVISOR = 10
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -224,5 +300,15 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'business.shopify_client': {
+            'handlers': ['file_shopify', 'console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'business.shopify_async': {
+            'handlers': ['file_shopify', 'console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }